@@ -1,5 +1,12 @@
 var checkout = {};
 
+// One Lex session per browser tab, so concurrent users do not share dialog state
+var sessionId = sessionStorage.getItem('chatbotSessionId');
+if (!sessionId) {
+  sessionId = 'web-' + Date.now().toString(36) + '-' + Math.random().toString(36).substring(2);
+  sessionStorage.setItem('chatbotSessionId', sessionId);
+}
+
 $(document).ready(function() {
   var $messages = $('.messages-content'),
     d, h, m,
@@ -28,6 +35,7 @@ $(document).ready(function() {
   function callChatbotApi(message) {
     // params, body, additionalParams
     return sdk.chatbotPost({}, {
+      sessionId: sessionId,
       messages: [{
         type: 'unstructured',
         unstructured: {
@@ -0,0 +1,86 @@
+"""
+Measures the per-call setup the lambdas used to pay against the shared clients module:
+building boto3 clients, SigV4 auth and SendGrid clients on every call, and a new connection per HTTP request
+instead of a pooled keep-alive session (against a local HTTP server, so no TLS handshake is included).
+
+    python benchmarks/bench_clients.py
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import boto3
+import requests
+from requests_aws4auth import AWS4Auth
+from sendgrid import SendGridAPIClient
+
+import clients
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer each response into a single write, so keep-alive requests do not wait on delayed ACKs
+    wbufsize = -1
+
+    def do_GET(self):
+        body = b'{"hits": {"hits": []}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def per_call_ms(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def per_call_es_auth():
+    credentials = boto3.Session().get_credentials()
+    return AWS4Auth(credentials.access_key, credentials.secret_key, 'us-east-1', 'es', session_token=credentials.token)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=200)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SearchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/restaurants/_search?q=indian'.format(server.server_address[1])
+    shared_auth = clients.RefreshingAWS4Auth(boto3.Session().get_credentials(), 'us-east-1', 'es')
+    session = clients.es_session('us-east-1')
+
+    cases = [
+        ('boto3 sqs client', lambda: boto3.client('sqs'), lambda: clients.client('sqs')),
+        ('ES SigV4 auth', per_call_es_auth, shared_auth.current),
+        ('SendGrid client', lambda: SendGridAPIClient('key'), lambda: clients.sendgrid_client('key')),
+        ('ES search request', lambda: requests.get(url, auth=per_call_es_auth()), lambda: session.get(url)),
+    ]
+
+    print('{:<20} {:>14} {:>14} {:>12}'.format('', 'per call ms', 'shared ms', 'saved ms'))
+    for name, per_call, shared in cases:
+        before = per_call_ms(per_call, args.repeats)
+        after = per_call_ms(shared, args.repeats)
+        print('{:<20} {:>14.3f} {:>14.3f} {:>12.3f}'.format(name, before, after, before - after))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Measures the cold start of lf0, lf1 and lf2: the import time of each handler module, the latency of its first
+invocation and of a second, warm one, with the import time broken down by top level package.
+
+Every run imports the handler in a fresh interpreter started with `python -X importtime`. The AWS, SendGrid and
+Elasticsearch clients are really created on first use, as they would be in Lambda, but their calls go to the
+in-process stand-ins, so the first invocation pays for loading boto3 and friends without any network latency.
+
+    python benchmarks/bench_cold_start.py --runs 5 --save-baseline benchmarks/cold-start-baseline.json
+    python benchmarks/bench_cold_start.py --runs 5 --baseline benchmarks/cold-start-baseline.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+lambdas_dir = os.path.join(benchmarks_dir, '..')
+
+""" --- Constants --- """
+handlers = ['lf0', 'lf1', 'lf2']
+begin_marker = 'cold-start: begin import'
+end_marker = 'cold-start: end import'
+environment = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'BOT_ID': 'BOT',
+    'BOT_ALIAS_ID': 'ALIAS',
+    'DYNAMODB_TABLE': 'yelp-restaurants',
+    'SQS_URL': 'https://sqs.us-east-1.amazonaws.com/000000000000/cold-start',
+    'ELASTIC_SEARCH_HOST': 'https://search-restaurants.us-east-1.es.amazonaws.com/',
+    'ELASTIC_SEARCH_REGION': 'us-east-1',
+    'ELASTIC_SEARCH_INDEX': 'restaurants',
+    'SENDGRID_API_KEY': 'SG.cold-start',
+    'FROM_EMAIL': 'concierge@example.com',
+    'SQS_WAIT_TIME_SECONDS': '0',
+    'LOG_SAMPLE_RATE': '0',
+}
+
+
+def message_values():
+    return {'location': 'Manhattan', 'cuisine': 'indian', 'numberOfPpl': '4', 'date': '2030-01-01', 'time': '19:30',
+            'phoneNumber': '2125550100', 'emailAddress': 'user@example.com'}
+
+
+def patch_clients(clients, fakes):
+    """
+    Creates the real clients, which is part of the cold start, but hands out the stand-ins.
+    """
+    create_client, create_resource = clients.client, clients.resource
+    create_sendgrid, create_es_session = clients.sendgrid_client, clients.es_session
+
+    def client(service_name):
+        create_client(service_name)
+        return fakes[service_name]
+
+    def resource(service_name):
+        create_resource(service_name)
+        return fakes['dynamodb']
+
+    def sendgrid_client(api_key):
+        create_sendgrid(api_key)
+        return fakes['sendgrid']
+
+    def es_session(region, service='es'):
+        create_es_session(region, service)
+        return fakes['es_session']
+
+    clients.client, clients.resource = client, resource
+    clients.sendgrid_client, clients.es_session = sendgrid_client, es_session
+
+
+def invocation(name, handler):
+    """
+    Returns a function making one representative invocation of the handler.
+    """
+    import clients
+    import message_codec
+    from fakes import (FakeContext, FakeDynamoDB, FakeElasticSearch, FakeElasticSearchSession, FakeLexRuntime,
+                       FakeSendGrid, FakeSNS, FakeSQS, cuisines, lex_event)
+
+    dynamodb = FakeDynamoDB()
+    es = FakeElasticSearch()
+    sqs = FakeSQS()
+    table = dynamodb.Table(environment['DYNAMODB_TABLE'])
+    for cuisine in cuisines:
+        for i in range(20):
+            id = '{}-{}'.format(cuisine, i)
+            table.put_item(Item={'id': id, 'name': 'Restaurant {}'.format(id), 'address': '{} Broadway'.format(i),
+                                 'rating': '4.0', 'review_count': str(10 * i)})
+            es.index(index='restaurants', id=id, body={'id': id, 'categories': cuisine})
+    patch_clients(clients, {'lexv2-runtime': FakeLexRuntime(), 'sqs': sqs, 'sns': FakeSNS(), 'dynamodb': dynamodb,
+                            'sendgrid': FakeSendGrid(), 'es_session': FakeElasticSearchSession(es)})
+
+    if name == 'lf0':
+        event = {'messages': [{'type': 'unstructured', 'sessionId': 'cold-start',
+                               'unstructured': {'text': 'I need some restaurant suggestions'}}]}
+        return lambda: handler.lambda_handler(event, FakeContext())
+    if name == 'lf1':
+        event = lex_event(message_values(), 'FulfillmentCodeHook')
+        return lambda: handler.lambda_handler(event, None)
+
+    fulfillments = iter(range(1000))
+
+    def drain():
+        # Every drain has a new request to fulfil, a repeated one would be skipped as already fulfilled
+        body = message_codec.encode(message_values(), 'cold-start-{}'.format(next(fulfillments)))
+        sqs.send_message(QueueUrl=environment['SQS_URL'], MessageBody=body)
+        return handler.lambda_handler({}, FakeContext())
+    return drain
+
+
+def child(name):
+    os.environ.update(environment)
+    sys.path.insert(0, os.path.join(lambdas_dir, 'shared'))
+    sys.path.insert(0, os.path.join(lambdas_dir, name))
+    import contextlib
+    import importlib
+
+    # The markers delimit the lines -X importtime writes for the handler import
+    print(begin_marker, file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    handler = importlib.import_module('lambda_function')
+    import_millis = (time.perf_counter() - start) * 1000
+    print(end_marker, file=sys.stderr, flush=True)
+
+    sys.path.insert(0, benchmarks_dir)
+    invoke = invocation(name, handler)
+    timings = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(2):
+            start = time.perf_counter()
+            invoke()
+            timings.append((time.perf_counter() - start) * 1000)
+    print(json.dumps({'import_ms': import_millis, 'first_invocation_ms': timings[0], 'warm_invocation_ms': timings[1]}))
+
+
+def import_breakdown(stderr):
+    """
+    Self import time in ms by top level package, from the -X importtime lines of the handler import.
+    """
+    packages = {}
+    inside = False
+    for line in stderr.splitlines():
+        if line == begin_marker:
+            inside = True
+        elif line == end_marker:
+            break
+        elif inside and line.startswith('import time:') and '|' in line:
+            self_us, _, module = line[len('import time:'):].split('|')
+            if not self_us.strip().isdigit():
+                continue
+            package = module.strip().split('.')[0]
+            packages[package] = packages.get(package, 0.0) + int(self_us) / 1000
+    return packages
+
+
+def measure(name, runs):
+    results = []
+    breakdowns = []
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--child', name],
+                                 capture_output=True, text=True, check=True)
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+        breakdowns.append(import_breakdown(process.stderr))
+
+    summary = {key: round(statistics.median(result[key] for result in results), 3) for key in results[0]}
+    packages = {package for breakdown in breakdowns for package in breakdown}
+    summary['modules_ms'] = {package: round(statistics.median(breakdown.get(package, 0.0) for breakdown in breakdowns), 3)
+                             for package in packages}
+    return summary
+
+
+def change(current, baseline):
+    if not baseline:
+        return ''
+    return '{:+.1f}%'.format((current - baseline) / baseline * 100)
+
+
+def report(summaries, top, baseline=None):
+    baseline = baseline or {}
+    print('{:<8} {:>12} {:>10} {:>16} {:>10} {:>12}'.format('handler', 'import ms', 'vs base', 'first call ms',
+                                                              'vs base', 'warm call ms'))
+    for name, summary in summaries.items():
+        base = baseline.get(name, {})
+        print('{:<8} {:>12.1f} {:>10} {:>16.1f} {:>10} {:>12.2f}'.format(
+            name, summary['import_ms'], change(summary['import_ms'], base.get('import_ms')),
+            summary['first_invocation_ms'], change(summary['first_invocation_ms'], base.get('first_invocation_ms')),
+            summary['warm_invocation_ms']))
+
+    for name, summary in summaries.items():
+        print()
+        print('{} import time by package (self, ms)'.format(name))
+        base = baseline.get(name, {}).get('modules_ms', {})
+        for package, millis in sorted(summary['modules_ms'].items(), key=lambda item: -item[1])[:top]:
+            print('  {:<30} {:>8.2f} {:>10}'.format(package, millis, change(millis, base.get(package))))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--child', choices=handlers, help=argparse.SUPPRESS)
+    parser.add_argument('--handlers', nargs='+', choices=handlers, default=handlers)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per handler, the medians are reported')
+    parser.add_argument('--top', type=int, default=10, help='packages listed in the import breakdown')
+    parser.add_argument('--baseline', help='compare with a summary saved by --save-baseline')
+    parser.add_argument('--save-baseline', help='write the summary of this run as JSON')
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    summaries = {name: measure(name, args.runs) for name in args.handlers}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(summaries, args.top, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(summaries, f, indent=2, sort_keys=True)
+        print('Saved baseline to {}'.format(args.save_baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Loads a catalog with the delta loader, then changes a small share of it and loads it again.
+The second run's DynamoDB batches and Elasticsearch requests follow the number of changed rows, not the catalog size.
+
+    python benchmarks/bench_delta_load.py --restaurants 50000 --change-percent 1
+"""
+import os
+import csv
+import time
+import random
+import argparse
+import tempfile
+import importlib.util
+
+from fakes import FakeElasticSearch, FakeTable, write_restaurants_csv
+
+loader_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'catalog-delta-load.py')
+spec = importlib.util.spec_from_file_location('delta_loader', loader_path)
+delta_loader = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(delta_loader)
+
+
+def change_catalog(path, percent, seed=1):
+    """
+    Rewrites the catalog with percent of the rows changed, and as many removed and added.
+    """
+    rng = random.Random(seed)
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    header, rows = rows[0], rows[1:]
+    count = max(1, len(rows) * percent // 100)
+    for row in rng.sample(rows, count):
+        row[5] = str(rng.choice([3.0, 3.5, 4.0, 4.5, 5.0]) + 0.01)
+    for row in rng.sample(rows, count):
+        rows.remove(row)
+    for i in range(count):
+        rows.append(['new-restaurant-{}'.format(i), 'New Restaurant {}'.format(i), '{} Broadway'.format(i),
+                     "{'latitude': 40.75, 'longitude': -73.98}", '1', '5.0', '10001', 'indian'])
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def run(csv_path, manifest_path, table, es):
+    batches, requests = table.batches, es.requests
+    manifest = delta_loader.load_manifest(manifest_path)
+    sinks = [delta_loader.DynamoDBSink(table), delta_loader.ElasticsearchSink(es)]
+    start = time.perf_counter()
+    new_manifest, counts = delta_loader.delta_load(delta_loader.es_loader.read_restaurants(csv_path), manifest, sinks)
+    elapsed = time.perf_counter() - start
+    delta_loader.save_manifest(manifest_path, new_manifest)
+    return counts, table.batches - batches, es.requests - requests, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--restaurants', type=int, default=50000)
+    parser.add_argument('--change-percent', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    table = FakeTable('yelp-restaurants', latency=args.latency_ms / 1000)
+    es = FakeElasticSearch(latency=args.latency_ms / 1000)
+    print('{:<10} {:>8} {:>8} {:>8} {:>10} {:>14} {:>12} {:>8}'.format(
+        'run', 'added', 'changed', 'removed', 'unchanged', 'DDB batches', 'ES requests', 'seconds'))
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'Restaurants.csv')
+        manifest_path = os.path.join(directory, 'restaurants.manifest.json')
+        write_restaurants_csv(csv_path, args.restaurants)
+
+        for name in ['initial', 'delta']:
+            if name == 'delta':
+                change_catalog(csv_path, args.change_percent)
+            counts, batches, requests, elapsed = run(csv_path, manifest_path, table, es)
+            print('{:<10} {added:>8} {changed:>8} {removed:>8} {unchanged:>10} {:>14} {:>12} {:>8.2f}'.format(
+                name, batches, requests, elapsed, **counts))
+
+        assert len(table.items) == len(es.documents) == len(delta_loader.load_manifest(manifest_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares indexing Restaurants.csv one document at a time with a forced refresh (the old loader)
+against the streaming parallel _bulk loader, on an in-process ES stand-in with per-request latency.
+
+    python benchmarks/bench_es_loader.py --restaurants 20000 --latency-ms 5
+"""
+import os
+import time
+import argparse
+import tempfile
+import importlib.util
+
+from fakes import FakeElasticSearch, write_restaurants_csv
+
+loader_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'elastic-search-data-inject.py')
+spec = importlib.util.spec_from_file_location('es_loader', loader_path)
+es_loader = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(es_loader)
+
+""" --- Constants --- """
+# Small enough for the checks to split the file into many chunks
+check_chunk_bytes = 64 * 1024
+
+
+def per_document(es, restaurants):
+    start = time.perf_counter()
+    count = 0
+    for restaurant in restaurants:
+        index_data = {'id': restaurant[0], 'categories': restaurant[7]}
+        es.index(index=es_loader.index, doc_type=es_loader.doc_type, id=restaurant[0], body=index_data, refresh=True)
+        count += 1
+    return count, time.perf_counter() - start
+
+
+def check_load(restaurants, path, max_bytes, in_flight):
+    """
+    Loads the file again in small chunks into an index with a refresh interval set, once as is and once with its first chunk failing,
+    and checks what the loader indexed, reported and restored.
+    """
+    es = FakeElasticSearch()
+    es.indices.create(index=es_loader.index)
+    es.indices.put_settings(index=es_loader.index, body={'index': {'refresh_interval': '30s'}})
+    sent, indexed, errors, _ = es_loader.load(es, es_loader.read_restaurants(path), max_bytes, in_flight)
+    assert sent == indexed == len(es.documents) == restaurants, (sent, indexed, len(es.documents))
+    assert errors == [], errors[:5]
+    assert es_loader.get_refresh_interval(es) == '30s', es_loader.get_refresh_interval(es)
+
+    es = FakeElasticSearch()
+    es.indices.create(index=es_loader.index)
+    es.indices.put_settings(index=es_loader.index, body={'index': {'refresh_interval': '30s'}})
+    bulk = es.bulk
+
+    def failing_bulk(body, **kwargs):
+        if b'"restaurant-0"' in body:
+            raise IOError('HTTP 500')
+        return bulk(body, **kwargs)
+
+    es.bulk = failing_bulk
+    sent, indexed, errors, _ = es_loader.load(es, es_loader.read_restaurants(path), max_bytes, in_flight)
+    assert len(errors) == 1 and errors[0]['chunk'] == 0, errors
+    assert sent == restaurants and indexed == len(es.documents) == restaurants - errors[0]['documents'], (sent, indexed, errors)
+    assert 'restaurant-0' not in es.documents
+    assert es_loader.get_refresh_interval(es) == '30s', es_loader.get_refresh_interval(es)
+    print('checks        loaded every row, reported the failed chunk of {} documents and restored the refresh interval'.format(
+        errors[0]['documents']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--restaurants', type=int, default=20000)
+    parser.add_argument('--per-document-sample', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    parser.add_argument('--refresh-latency-ms', type=float, default=5)
+    parser.add_argument('--max-chunk-bytes', type=int, default=es_loader.max_chunk_bytes)
+    parser.add_argument('--in-flight', type=int, default=es_loader.max_in_flight)
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    refresh_latency = args.refresh_latency_ms / 1000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'Restaurants.csv')
+        write_restaurants_csv(path, args.restaurants)
+
+        # The old loader is too slow to run over the whole file, it is timed on a sample
+        es = FakeElasticSearch(latency, refresh_latency)
+        sample = (row for i, row in enumerate(es_loader.read_restaurants(path)) if i < args.per_document_sample)
+        count, elapsed = per_document(es, sample)
+        print('per document  {:>8} docs {:>8} requests {:>10.0f} docs/sec'.format(count, es.requests, count / elapsed))
+
+        es = FakeElasticSearch(latency, refresh_latency)
+        sent, indexed, errors, elapsed = es_loader.load(es, es_loader.read_restaurants(path), args.max_chunk_bytes, args.in_flight)
+        print('bulk          {:>8} docs {:>8} requests {:>10.0f} docs/sec, {} errors'.format(
+            indexed, es.requests, indexed / elapsed, len(errors)))
+
+        check_load(args.restaurants, path, min(args.max_chunk_bytes, check_chunk_bytes), args.in_flight)
+
+
+if __name__ == '__main__':
+    main()
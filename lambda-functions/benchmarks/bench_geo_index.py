@@ -0,0 +1,77 @@
+"""
+Times "closest k restaurants of a cuisine to a point" with the KD-tree index against a scan of the cuisine,
+for catalogs of growing size. Every query is checked against the scan.
+
+    python benchmarks/bench_geo_index.py
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lf2'))
+
+from fakes import cuisines, write_restaurants_csv
+from geo_index import GeoIndex, chord_to_km, unit_vector
+from restaurant_snapshot import build_snapshot, load_snapshot
+import locations
+
+""" --- Constants --- """
+catalog_sizes = [5000, 50000, 500000]
+
+
+def scan(points, latitude, longitude, k):
+    target = unit_vector(latitude, longitude)
+    distances = []
+    for point_latitude, point_longitude, value in points:
+        point = unit_vector(point_latitude, point_longitude)
+        distances.append((sum((a - b) ** 2 for a, b in zip(point, target)), value))
+    return [(chord_to_km(squared), value) for squared, value in sorted(distances)[:k]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--scans', type=int, default=20)
+    parser.add_argument('--k', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    places = list(locations.known_locations.values())
+    print('{:>10} {:>14} {:>12} {:>12} {:>10}'.format('items', 'build ms/tree', 'query us', 'scan us', 'speedup'))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in catalog_sizes:
+            csv_path = os.path.join(directory, 'Restaurants.csv')
+            snapshot_path = os.path.join(directory, 'restaurants.snapshot')
+            write_restaurants_csv(csv_path, size)
+            build_snapshot(csv_path, snapshot_path)
+            snapshot = load_snapshot(snapshot_path)
+            index = GeoIndex.from_snapshot(snapshot)
+
+            start = time.perf_counter()
+            for cuisine in cuisines:
+                index.tree(cuisine)
+            build_ms = (time.perf_counter() - start) / len(cuisines) * 1000
+
+            queries = [(cuisines[i % len(cuisines)],) + rng.choice(places) for i in range(args.queries)]
+            start = time.perf_counter()
+            for cuisine, latitude, longitude in queries:
+                index.nearest(cuisine, latitude, longitude, args.k)
+            query_us = (time.perf_counter() - start) / len(queries) * 1000000
+
+            points = {cuisine: index.points_for_term(cuisine) for cuisine in cuisines}
+            start = time.perf_counter()
+            for cuisine, latitude, longitude in queries[:args.scans]:
+                expected = scan(points[cuisine], latitude, longitude, args.k)
+                assert [value for _, value in index.nearest(cuisine, latitude, longitude, args.k)] == [value for _, value in expected]
+            scan_us = (time.perf_counter() - start) / args.scans * 1000000
+            snapshot.close()
+
+            print('{:>10} {:>14.1f} {:>12.1f} {:>12.0f} {:>9.0f}x'.format(size, build_ms, query_us, scan_us, scan_us / query_us))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Measures what a redelivery costs lf2 when a drain delivered its suggestions but died before deleting the messages.
+The batch is drained once without deletes, the messages are made visible again, and the second drain is timed:
+without duplicate detection, with the fulfilled requests still in the container's cache, in a new container
+that has to read them from the table, and in a new container while the first one still holds its claims.
+
+    python benchmarks/bench_idempotency.py --messages 100 --latency-ms 10
+"""
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('DYNAMODB_TABLE', 'yelp-restaurants')
+os.environ.setdefault('IDEMPOTENCY_TABLE', 'fulfilled-requests')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lf2'))
+
+from fakes import FakeContext, FakeDynamoDB, FakeElasticSearch, FakeElasticSearchSession, FakeSendGrid, FakeSQS, cuisines
+import clients
+import message_codec
+import lambda_function as lf2
+
+""" --- Constants --- """
+restaurants_per_cuisine = 50
+
+
+def setup(latency):
+    dynamodb = FakeDynamoDB()
+    es = FakeElasticSearch()
+    table = dynamodb.Table(lf2.dynamodb_table)
+    for cuisine in cuisines:
+        for i in range(restaurants_per_cuisine):
+            id = '{}-{}'.format(cuisine, i)
+            table.put_item(Item={'id': id, 'name': 'Restaurant {}'.format(id), 'address': '{} Broadway'.format(i),
+                                 'rating': '4.0', 'review_count': str(i)})
+            es.index(index='restaurants', id=id, body={'id': id, 'categories': cuisine})
+    dynamodb.latency = latency
+    dynamodb.Table(lf2.idempotency_table).latency = latency
+    es.latency = latency
+
+    calls = {'restaurant lookups': 0}
+    batch_get_item = dynamodb.batch_get_item
+
+    def counted(RequestItems, **kwargs):
+        if lf2.dynamodb_table in RequestItems:
+            calls['restaurant lookups'] += 1
+        return batch_get_item(RequestItems=RequestItems, **kwargs)
+
+    dynamodb.batch_get_item = counted
+    sqs = FakeSQS(latency=latency)
+    FakeSendGrid.latency = latency * 5
+    FakeSendGrid.sent = []
+    clients.client = lambda service_name: sqs
+    clients.resource = lambda service_name: dynamodb
+    clients.sendgrid_client = FakeSendGrid
+    clients.es_session = lambda region, service='es': FakeElasticSearchSession(es)
+    lf2.max_wait_time_seconds = 0
+    lf2.snapshot = None
+    lf2.restaurants = None
+    lf2.fulfilled_requests = None
+    lf2.fulfilled_cache.invalidate()
+    lf2.invalidate_caches()
+    return sqs, es, dynamodb, calls
+
+
+def emails_sent():
+    return sum(len(mail['personalizations']) for mail in FakeSendGrid.sent)
+
+
+def run(mode, messages, latency):
+    sqs, es, dynamodb, calls = setup(latency)
+    if mode == 'no duplicate detection':
+        # Nothing is ever found fulfilled or claimed, as before the requests were keyed
+        lf2.fulfilled_request_store().fulfilled = lambda keys: set()
+        lf2.fulfilled_request_store().claim = lambda senders: set(senders)
+    for i in range(messages):
+        values = {'location': 'Manhattan', 'cuisine': cuisines[i % len(cuisines)], 'numberOfPpl': '4', 'date': '2030-01-01',
+                  'time': '19:00', 'phoneNumber': '2125550100', 'emailAddress': 'user{}@example.com'.format(i)}
+        sqs.send_message(QueueUrl=lf2.sqs_url, MessageBody=message_codec.encode(values, 'fulfillment-{}'.format(i)))
+
+    # The first drain delivers everything but never acknowledges it
+    delete_messages_from_queue = lf2.delete_messages_from_queue
+    lf2.delete_messages_from_queue = lambda succeeded: None
+    lf2.lambda_handler({}, FakeContext())
+    lf2.delete_messages_from_queue = delete_messages_from_queue
+    sqs.release_in_flight()
+
+    if mode in ('new container', 'concurrent delivery'):
+        lf2.fulfilled_cache.invalidate()
+    if mode == 'concurrent delivery':
+        # As if the first container had claimed the requests and was still sending them
+        for item in dynamodb.Table(lf2.idempotency_table).items.values():
+            item['status'] = 'claimed'
+    lf2.invalidate_caches()
+    before = {'emails': emails_sent(), 'es requests': es.requests, 'restaurant lookups': calls['restaurant lookups']}
+    start = time.perf_counter()
+    lf2.lambda_handler({}, FakeContext())
+    elapsed = (time.perf_counter() - start) * 1000
+    return {'drain ms': elapsed,
+            'left on queue': sqs.pending(),
+            'emails': emails_sent() - before['emails'],
+            'es requests': es.requests - before['es requests'],
+            'restaurant lookups': calls['restaurant lookups'] - before['restaurant lookups']}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    results = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for mode in ['no duplicate detection', 'same container', 'new container', 'concurrent delivery']:
+            results[mode] = run(mode, args.messages, args.latency_ms / 1000)
+
+    print('Redelivery of {} fulfilled messages'.format(args.messages))
+    print('{:<24} {:>10} {:>8} {:>14} {:>12} {:>20}'.format('mode', 'drain ms', 'emails', 'left on queue', 'es requests',
+                                                             'restaurant lookups'))
+    for mode, result in results.items():
+        print('{:<24} {:>10.1f} {:>8} {:>14} {:>12} {:>20}'.format(mode, result['drain ms'], result['emails'], result['left on queue'],
+                                                                   result['es requests'], result['restaurant lookups']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Load test for lf0 with a stubbed Lex runtime: every invocation carries one message per concurrent user,
+each user with their own session, and the throughput is reported as the number of users grows.
+
+    python benchmarks/bench_lf0_load.py --latency-ms 50
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lf0'))
+
+from fakes import FakeLexRuntime
+import clients
+import lambda_function as lf0
+
+""" --- Constants --- """
+user_counts = [1, 2, 4, 8, 16, 32, 64]
+
+
+def event(users, round):
+    return {'messages': [{'type': 'unstructured', 'sessionId': 'user-{}'.format(user),
+                          'unstructured': {'text': 'message {} from user {}'.format(round, user)}}
+                         for user in range(users)]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>6} {:>16} {:>14}'.format('users', 'messages/sec', 'p100 ms'))
+    for users in user_counts:
+        lex = FakeLexRuntime(latency=args.latency_ms / 1000)
+        clients.client = lambda service_name: lex
+
+        slowest = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for round in range(args.rounds):
+                invocation_start = time.perf_counter()
+                response = lf0.lambda_handler(event(users, round), None)
+                slowest = max(slowest, time.perf_counter() - invocation_start)
+        elapsed = time.perf_counter() - start
+
+        # Every user must have had their own session, with one turn per round
+        assert len(lex.turns) == users and set(lex.turns.values()) == {args.rounds}
+        assert len(response['messages']) == users
+        print('{:>6} {:>16.1f} {:>14.1f}'.format(users, users * args.rounds / elapsed, slowest * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Walks a full dining conversation through lf1, one slot per turn, and reports for every turn
+how many slot validators ran and how long the code hook took.
+
+    python benchmarks/bench_lf1_validation.py
+"""
+import io
+import os
+import sys
+import time
+import logging
+import datetime
+import argparse
+import contextlib
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lf1'))
+
+from fakes import lex_event
+import lambda_function as lf1
+
+
+def conversation():
+    tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+    return [('location', 'Manhattan'), ('cuisine', 'indian'), ('numberOfPpl', '4'), ('date', tomorrow),
+            ('time', '19:30'), ('phoneNumber', '2125550100'), ('emailAddress', 'user@example.com')]
+
+
+def count_validations():
+    calls = {'count': 0}
+    for i, validator in enumerate(lf1.slot_validators):
+        def counted(value, values, validate=validator.validate):
+            calls['count'] += 1
+            return validate(value, values)
+        lf1.slot_validators[i] = validator._replace(validate=counted)
+    return calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    calls = count_validations()
+    values = {validator.slot: None for validator in lf1.slot_validators}
+    session_attributes = {}
+
+    print('{:>5} {:>14} {:>12} {:>12}'.format('turn', 'slot', 'validators', 'us/turn'))
+    for turn, (slot, value) in enumerate(conversation(), 1):
+        values[slot] = value
+        event = lex_event(values, session_attributes=session_attributes)
+
+        # The metrics line every invocation prints is kept out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            calls['count'] = 0
+            result = lf1.lambda_handler(event, None)
+            validations = calls['count']
+
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                lf1.lambda_handler(lex_event(values, session_attributes=session_attributes), None)
+            elapsed = (time.perf_counter() - start) / args.repeats
+
+        session_attributes = result['sessionState']['sessionAttributes']
+        print('{:>5} {:>14} {:>12} {:>12.1f}'.format(turn, slot, validations, elapsed * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Measures lf2 message throughput (messages/sec) with the sequential path (one worker)
+and with the worker pool, against in-process SQS, DynamoDB, Elasticsearch and SendGrid stand-ins
+that add a fixed latency to every call.
+
+    python benchmarks/bench_lf2_throughput.py --messages 100 --latency-ms 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('DYNAMODB_TABLE', 'yelp-restaurants')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lf2'))
+
+from fakes import FakeDynamoDB, FakeElasticSearch, FakeElasticSearchSession, FakeSendGrid, FakeSNS, FakeSQS
+from restaurant_repository import RestaurantRepository
+import clients
+import lambda_function as lf2
+
+""" --- Constants --- """
+cuisines = ['indian', 'chinese', 'japanese', 'italian', 'american']
+restaurants_per_cuisine = 50
+
+
+def slot(value):
+    return {'value': {'originalValue': value, 'interpretedValue': value, 'resolvedValues': [value]}}
+
+
+def message_body(i):
+    return json.dumps({
+        'location': slot('Manhattan'),
+        'cuisine': slot(cuisines[i % len(cuisines)]),
+        'numberOfPpl': slot('4'),
+        'date': slot('2030-01-01'),
+        'time': slot('19:00'),
+        'phoneNumber': slot('2125550100'),
+        'emailAddress': slot('user{}@example.com'.format(i))
+    })
+
+
+def setup(latency):
+    dynamodb = FakeDynamoDB()
+    es = FakeElasticSearch()
+    table = dynamodb.Table(lf2.dynamodb_table)
+    for cuisine in cuisines:
+        for i in range(restaurants_per_cuisine):
+            id = '{}-{}'.format(cuisine, i)
+            table.put_item(Item={'id': id, 'name': 'Restaurant {}'.format(id), 'address': '{} Broadway'.format(i)})
+            es.index(index='restaurants', id=id, body={'id': id, 'categories': cuisine})
+
+    dynamodb.latency = latency
+    es.latency = latency
+    sqs = FakeSQS(latency=latency)
+    FakeSendGrid.latency = latency
+    FakeSendGrid.sent = []
+    services = {'sqs': sqs, 'sns': FakeSNS(latency=latency)}
+    clients.client = lambda service_name: services[service_name]
+    # The drain ends on an empty receive, which must not long poll inside the timed loop
+    lf2.max_wait_time_seconds = 0
+    lf2.invalidate_caches()
+    # Both runs send the same requests, the second must not find them fulfilled by the first
+    lf2.fulfilled_cache.invalidate()
+    lf2.restaurants = RestaurantRepository(dynamodb, lf2.dynamodb_table, cache=lf2.restaurant_cache)
+    clients.es_session = lambda region, service='es': FakeElasticSearchSession(es)
+    clients.sendgrid_client = FakeSendGrid
+    return sqs
+
+
+def run(messages, workers, latency):
+    sqs = setup(latency)
+    for i in range(messages):
+        sqs.send_message(QueueUrl=lf2.sqs_url, MessageBody=message_body(i))
+
+    lf2.max_workers = workers
+    start = time.perf_counter()
+    while sqs.deleted < messages:
+        lf2.lambda_handler({}, None)
+    elapsed = time.perf_counter() - start
+    return messages / elapsed, len(FakeSendGrid.sent)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=10)
+    args = parser.parse_args()
+
+    # Keep the per-message prints of the handler out of the report
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        sequential = run(args.messages, 1, args.latency_ms / 1000)
+        concurrent = run(args.messages, args.workers, args.latency_ms / 1000)
+    finally:
+        sys.stdout = stdout
+
+    print('sequential          {:>10.1f} messages/sec {:>6} SendGrid requests'.format(*sequential))
+    print('{:>2} workers          {:>10.1f} messages/sec {:>6} SendGrid requests'.format(args.workers, *concurrent))
+    print('speedup             {:>10.1f}x'.format(concurrent[0] / sequential[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Compares the size and decode time of the compact fulfillment message with the full Lex slots lf1 used to send.
+
+    python benchmarks/bench_message_codec.py
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+from fakes import lex_slot
+import message_codec
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=100000)
+    args = parser.parse_args()
+
+    values = {'location': 'Manhattan', 'cuisine': 'indian', 'numberOfPpl': '4', 'date': '2030-01-01',
+              'time': '19:30', 'phoneNumber': '2125550100', 'emailAddress': 'user@example.com'}
+    bodies = [('legacy slots', json.dumps({slot: lex_slot(value) for slot, value in values.items()})),
+              ('compact v{}'.format(message_codec.version), message_codec.encode(values))]
+
+    print('{:<16} {:>8} {:>14}'.format('format', 'bytes', 'us/decode'))
+    for name, body in bodies:
+        assert message_codec.decode(body) == message_codec.decode(bodies[-1][1])
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            message_codec.decode(body)
+        elapsed = time.perf_counter() - start
+        print('{:<16} {:>8} {:>14.2f}'.format(name, len(body.encode('utf-8')), elapsed / args.repeats * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Times ranking 10k candidate restaurants down to the suggestions, with the partial sort
+and with a full sort of every score for comparison.
+
+    python benchmarks/bench_ranking.py --candidates 10000
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lf2'))
+
+import ranking
+
+
+def timed(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--candidates', type=int, default=10000)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    ratings = rng.choice([3.0, 3.5, 4.0, 4.5, 5.0], args.candidates)
+    review_counts = rng.integers(0, 5000, args.candidates).astype(np.float64)
+    distances_km = rng.uniform(0, 10, args.candidates)
+    groups = [str(zip_code) for zip_code in rng.integers(10001, 10282, args.candidates)]
+    noise = ranking.user_noise(0, args.candidates, 0.05)
+
+    def full_sort():
+        candidate_scores = ranking.scores(ratings, review_counts, distances_km, noise)
+        return np.argsort(-candidate_scores)[:args.k]
+
+    rows = [
+        ('rating + volume', lambda: ranking.rank(ratings, review_counts, args.k)),
+        ('+ distance, noise', lambda: ranking.rank(ratings, review_counts, args.k, distances_km, noise=noise)),
+        ('+ diversity', lambda: ranking.rank(ratings, review_counts, args.k, distances_km, groups, noise)),
+        ('full sort', full_sort),
+    ]
+    assert list(full_sort()) == ranking.rank(ratings, review_counts, args.k, distances_km, noise=noise)
+
+    print('{} candidates, top {}'.format(args.candidates, args.k))
+    for name, fn in rows:
+        print('{:<20} {:>10.1f} us'.format(name, timed(fn, args.repeats)))
+
+
+if __name__ == '__main__':
+    main()
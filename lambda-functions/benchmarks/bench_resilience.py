@@ -0,0 +1,123 @@
+"""
+Runs lf2 searches against an Elasticsearch stand-in with a slow tail, with and without hedging,
+then takes the domain down and measures how long the drain spends on it before the circuit opens.
+
+    python benchmarks/bench_resilience.py --searches 300 --slow-percent 5
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('DYNAMODB_TABLE', 'yelp-restaurants')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lf2'))
+
+from fakes import FakeContext, FakeElasticSearch, FakeElasticSearchSession, cuisines
+import clients
+import message_codec
+import metrics
+import resilience
+import lambda_function as lf2
+
+
+class FlakySession(FakeElasticSearchSession):
+    """
+    Answers after `latency`, except for slow_percent of the requests which take `slow_latency`. When down, hangs and fails.
+    """
+
+    def __init__(self, es, latency, slow_latency, slow_percent, rng):
+        super().__init__(es)
+        self.latency = latency
+        self.slow_latency = slow_latency
+        self.slow_percent = slow_percent
+        self.rng = rng
+        self.down = False
+        self.requests = 0
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        self.requests += 1
+        if self.down:
+            time.sleep(self.slow_latency)
+            raise IOError('Connection timed out')
+        time.sleep(self.slow_latency if self.rng.random() * 100 < self.slow_percent else self.latency)
+        return super().post(url, data, headers, **kwargs)
+
+
+def setup(args):
+    es = FakeElasticSearch()
+    for cuisine in cuisines:
+        for i in range(30):
+            id = '{}-{}'.format(cuisine, i)
+            es.index(index='restaurants', id=id, body={'id': id, 'categories': cuisine, 'name': id, 'address': '{} Broadway'.format(i)})
+    session = FlakySession(es, args.latency_ms / 1000, args.slow_latency_ms / 1000, args.slow_percent, random.Random(0))
+    clients.es_session = lambda region, service='es': session
+    lf2.snapshot = None
+    return session
+
+
+def searches(args, hedge_after):
+    lf2.es_hedge_after_seconds = hedge_after
+    resilience.reset()
+    timings = []
+    for i in range(args.searches):
+        start = time.perf_counter()
+        lf2.query_elastic_search([cuisines[i % len(cuisines)]])
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return metrics.percentile(timings, 50), metrics.percentile(timings, 99), metrics.percentile(timings, 100)
+
+
+def outage(args, session):
+    resilience.reset()
+    resilience.set_deadline(FakeContext(60000))
+    lf2.invalidate_caches()
+    session.down = True
+    session.requests = 0
+    messages = [{'MessageId': str(i), 'Body': message_codec.encode({
+        'location': 'Manhattan', 'cuisine': cuisines[i % len(cuisines)], 'numberOfPpl': '2', 'date': '2030-01-01',
+        'time': '19:00', 'phoneNumber': '2125550100', 'emailAddress': 'user{}@example.com'.format(i)})} for i in range(10)]
+
+    batches = []
+    for _ in range(args.outage_batches):
+        start = time.perf_counter()
+        prepared, failed = lf2.prepare_suggestions(messages)
+        batches.append((time.perf_counter() - start) * 1000)
+    session.down = False
+    return batches, session.requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--searches', type=int, default=300)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--slow-latency-ms', type=float, default=1000)
+    parser.add_argument('--slow-percent', type=float, default=5)
+    parser.add_argument('--outage-batches', type=int, default=8)
+    args = parser.parse_args()
+
+    # The failures are expected, keep their logs out of the report
+    logging.disable(logging.CRITICAL)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        session = setup(args)
+        plain = searches(args, None)
+        hedged = searches(args, 0.1)
+        batches, requests = outage(args, session)
+    finally:
+        sys.stdout = stdout
+
+    print('{:<14} {:>10} {:>10} {:>10}'.format('search ms', 'p50', 'p99', 'max'))
+    print('{:<14} {:>10.1f} {:>10.1f} {:>10.1f}'.format('no hedging', *plain))
+    print('{:<14} {:>10.1f} {:>10.1f} {:>10.1f}'.format('hedged 100ms', *hedged))
+    print()
+    print('ES down: {} requests sent for {} batches of 10 messages'.format(requests, len(batches)))
+    print('batch ms: {}'.format(' '.join('{:.0f}'.format(millis) for millis in batches)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares the per-id scan lookup lf2 used to do with the keyed batch lookup of RestaurantRepository,
+against an in-process DynamoDB stand-in, as the restaurants table grows.
+
+    python benchmarks/bench_restaurant_lookup.py
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+from boto3.dynamodb.conditions import Attr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lf2'))
+
+from fakes import FakeDynamoDB
+from restaurant_repository import RestaurantRepository
+
+""" --- Constants --- """
+table_name = 'yelp-restaurants'
+table_sizes = [5000, 50000, 500000]
+candidates_per_lookup = 10
+
+
+def populate(dynamodb, size):
+    table = dynamodb.Table(table_name)
+    for i in range(size):
+        table.put_item(Item={
+            'id': 'restaurant-{}'.format(i),
+            'name': 'Restaurant {}'.format(i),
+            'address': '{} Broadway'.format(i),
+            'cuisine': 'indian'
+        })
+    return table
+
+
+def scan_lookup(table, ids):
+    items = []
+    for id in ids:
+        response = table.scan(FilterExpression=Attr('id').eq(id))
+        items.extend(response['Items'][:1])
+    return items
+
+
+def timed(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--scan-repeats', type=int, default=2)
+    args = parser.parse_args()
+
+    print('{:>10} {:>14} {:>14}'.format('items', 'scan ms', 'batch get ms'))
+    for size in table_sizes:
+        dynamodb = FakeDynamoDB()
+        table = populate(dynamodb, size)
+        repository = RestaurantRepository(dynamodb, table_name)
+        ids = ['restaurant-{}'.format(random.randrange(size)) for _ in range(candidates_per_lookup)]
+
+        scan_ms = timed(lambda: scan_lookup(table, ids), args.scan_repeats)
+        batch_ms = timed(lambda: repository.get_many(ids), args.repeats)
+        print('{:>10} {:>14.3f} {:>14.3f}'.format(size, scan_ms, batch_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Compares lf2 answering from denormalised search documents (one hop) with id-only documents
+that need a DynamoDB lookup for the name and address (two hops). Caches are cleared before every batch,
+so each batch pays for its search and lookups.
+
+    python benchmarks/bench_single_hop.py --batches 20 --latency-ms 20
+"""
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('DYNAMODB_TABLE', 'yelp-restaurants')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lf2'))
+
+from fakes import FakeDynamoDB, FakeElasticSearch, FakeElasticSearchSession, cuisines
+from restaurant_repository import RestaurantRepository
+import clients
+import message_codec
+import metrics
+import lambda_function as lf2
+
+""" --- Constants --- """
+restaurants_per_cuisine = 50
+batch_size = 10
+
+
+def setup(denormalised, latency):
+    dynamodb = FakeDynamoDB()
+    es = FakeElasticSearch()
+    table = dynamodb.Table(lf2.dynamodb_table)
+    for cuisine in cuisines:
+        for i in range(restaurants_per_cuisine):
+            id = '{}-{}'.format(cuisine, i)
+            item = {'id': id, 'name': 'Restaurant {}'.format(id), 'address': '{} Broadway'.format(i),
+                    'rating': 4.5, 'review_count': 100 + i, 'zip_code': '10001'}
+            table.put_item(Item=item)
+            es.index(index='restaurants', id=id, body=dict(item, categories=cuisine) if denormalised else {'id': id, 'categories': cuisine})
+
+    dynamodb.latency = latency
+    es.latency = latency
+    calls = {'batch_get_item': 0}
+    batch_get_item = dynamodb.batch_get_item
+
+    def counted(**kwargs):
+        calls['batch_get_item'] += 1
+        return batch_get_item(**kwargs)
+
+    dynamodb.batch_get_item = counted
+    lf2.snapshot = None
+    lf2.restaurants = RestaurantRepository(dynamodb, lf2.dynamodb_table, cache=lf2.restaurant_cache)
+    clients.es_session = lambda region, service='es': FakeElasticSearchSession(es)
+    return calls
+
+
+def batch(number):
+    return [{'MessageId': '{}-{}'.format(number, i), 'Body': message_codec.encode({
+        'location': 'Manhattan', 'cuisine': cuisines[i % len(cuisines)], 'numberOfPpl': '4', 'date': '2030-01-01',
+        'time': '19:00', 'phoneNumber': '2125550100', 'emailAddress': 'user{}-{}@example.com'.format(number, i)})}
+        for i in range(batch_size)]
+
+
+def run(denormalised, batches, latency):
+    calls = setup(denormalised, latency)
+    per_message = []
+    for number in range(batches):
+        lf2.invalidate_caches()
+        messages = batch(number)
+        start = time.perf_counter()
+        prepared, failed = lf2.prepare_suggestions(messages)
+        per_message.append((time.perf_counter() - start) * 1000 / len(messages))
+        assert not failed and len(prepared) == len(messages)
+    per_message.sort()
+    return metrics.percentile(per_message, 50), metrics.percentile(per_message, 95), calls['batch_get_item'] / batches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    # Keep the handler prints out of the report
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        two_hops = run(False, args.batches, args.latency_ms / 1000)
+        one_hop = run(True, args.batches, args.latency_ms / 1000)
+    finally:
+        sys.stdout = stdout
+
+    print('{:<20} {:>12} {:>12} {:>22}'.format('documents', 'p50 ms/msg', 'p95 ms/msg', 'DynamoDB calls/batch'))
+    print('{:<20} {:>12.2f} {:>12.2f} {:>22.1f}'.format('id only', *two_hops))
+    print('{:<20} {:>12.2f} {:>12.2f} {:>22.1f}'.format('denormalised', *one_hop))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Builds restaurant snapshots of growing size and times cuisine lookups against them.
+
+    python benchmarks/bench_snapshot.py
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lf2'))
+
+from fakes import cuisines, write_restaurants_csv
+from restaurant_snapshot import build_snapshot, load_snapshot
+
+""" --- Constants --- """
+catalog_sizes = [5000, 50000, 500000]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--limit', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:>10} {:>12} {:>12} {:>14}'.format('items', 'build s', 'size KiB', 'lookup us'))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in catalog_sizes:
+            csv_path = os.path.join(directory, 'Restaurants.csv')
+            snapshot_path = os.path.join(directory, 'restaurants.snapshot')
+            write_restaurants_csv(csv_path, size)
+
+            start = time.perf_counter()
+            build_snapshot(csv_path, snapshot_path)
+            build_seconds = time.perf_counter() - start
+
+            snapshot = load_snapshot(snapshot_path)
+            start = time.perf_counter()
+            for i in range(args.lookups):
+                snapshot.find(cuisines[i % len(cuisines)], args.limit)
+            lookup_us = (time.perf_counter() - start) / args.lookups * 1000000
+            snapshot.close()
+
+            print('{:>10} {:>12.2f} {:>12.0f} {:>14.2f}'.format(size, build_seconds, os.path.getsize(snapshot_path) / 1024, lookup_us))
+
+
+if __name__ == '__main__':
+    main()
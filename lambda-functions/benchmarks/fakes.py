@@ -0,0 +1,456 @@
+"""
+In-process stand-ins for the AWS services used by the lambdas, for local benchmarks.
+"""
+import copy
+import csv
+import json
+import time
+import random
+import uuid
+import zlib
+import threading
+from collections import deque
+
+
+""" --- Constants --- """
+csv_header = ['id', 'name', 'address', 'coordinates', 'review_count', 'rating', 'zip_code', 'cuisine']
+cuisines = ['indian', 'chinese', 'japanese', 'italian', 'american']
+
+
+def write_restaurants_csv(path, size, seed=0):
+    """
+    Writes a synthetic catalog with the same columns as Restaurants.csv, spread over Manhattan.
+    """
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(csv_header)
+        for i in range(size):
+            coordinates = {'latitude': round(rng.uniform(40.70, 40.88), 6), 'longitude': round(rng.uniform(-74.02, -73.91), 6)}
+            writer.writerow([
+                'restaurant-{}'.format(i),
+                'Restaurant {}'.format(i),
+                '{} Broadway, New York, NY'.format(i),
+                str(coordinates),
+                str(rng.randint(1, 5000)),
+                str(rng.choice([3.0, 3.5, 4.0, 4.5, 5.0])),
+                str(rng.randint(10001, 10282)),
+                cuisines[i % len(cuisines)]
+            ])
+
+
+def lex_slot(value):
+    if value is None:
+        return None
+    return {'shape': 'Scalar', 'value': {'originalValue': value, 'interpretedValue': value, 'resolvedValues': [value]}}
+
+
+def lex_event(values, invocation_source='DialogCodeHook', session_attributes=None, session_id='benchmark-session'):
+    """
+    Lex V2 code hook event for the DiningSuggestionsIntent with the given interpreted slot values.
+    """
+    return {
+        'sessionId': session_id,
+        'bot': {'name': 'DiningConcierge', 'id': 'BOT', 'aliasId': 'ALIAS', 'localeId': 'en_US', 'version': 'DRAFT'},
+        'invocationSource': invocation_source,
+        'inputMode': 'Text',
+        'sessionState': {
+            'sessionAttributes': dict(session_attributes or {}),
+            'intent': {
+                'name': 'DiningSuggestionsIntent',
+                'state': 'InProgress',
+                'slots': {slot: lex_slot(value) for slot, value in values.items()}
+            }
+        }
+    }
+
+
+def _matches(item, condition):
+    # Evaluates the simple boto3 conditions the lambdas use (Attr(...).eq/lt/not_exists() joined with & and |)
+    expression = condition.get_expression()
+    operator = expression['operator']
+    values = expression['values']
+    if operator == 'AND':
+        return all(_matches(item, value) for value in values)
+    if operator == 'OR':
+        return any(_matches(item, value) for value in values)
+    if operator == '=':
+        return item.get(values[0].name) == values[1]
+    if operator == '<':
+        return values[0].name in item and item[values[0].name] < values[1]
+    if operator == 'attribute_not_exists':
+        return values[0].name not in item
+    raise NotImplementedError('Unsupported condition operator {}'.format(operator))
+
+
+def _project(item, request):
+    if 'ProjectionExpression' not in request:
+        return copy.deepcopy(item)
+    names = request.get('ExpressionAttributeNames', {})
+    attributes = [names.get(token.strip(), token.strip()) for token in request['ProjectionExpression'].split(',')]
+    return {attribute: item[attribute] for attribute in attributes if attribute in item}
+
+
+class FakeConditionalCheckFailed(Exception):
+    """
+    Raised like botocore's ClientError, with the error code in `response`.
+    """
+
+    def __init__(self):
+        super().__init__('The conditional request failed')
+        self.response = {'Error': {'Code': 'ConditionalCheckFailedException'}}
+
+
+def _wait(latency):
+    if latency:
+        time.sleep(latency)
+
+
+class FakeBatchWriter:
+
+    def __init__(self, table, flush_amount=25):
+        self.table = table
+        self.flush_amount = flush_amount
+        self.buffer = []
+
+    def put_item(self, Item):
+        self.buffer.append(('put', Item))
+        if len(self.buffer) >= self.flush_amount:
+            self.flush()
+
+    def delete_item(self, Key):
+        self.buffer.append(('delete', Key))
+        if len(self.buffer) >= self.flush_amount:
+            self.flush()
+
+    def flush(self):
+        _wait(self.table.latency)
+        with self.table.lock:
+            self.table.batches += 1
+            for operation, value in self.buffer:
+                if operation == 'put':
+                    self.table.items[value[self.table.key]] = copy.deepcopy(value)
+                else:
+                    self.table.items.pop(value[self.table.key], None)
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.buffer:
+            self.flush()
+
+
+class FakeTable:
+
+    def __init__(self, name, key='id', latency=0.0):
+        self.name = name
+        self.key = key
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.items = {}
+        self.batches = 0
+        self.puts = 0
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return FakeBatchWriter(self)
+
+    def put_item(self, Item, ConditionExpression=None, **kwargs):
+        _wait(self.latency)
+        with self.lock:
+            self.puts += 1
+            if ConditionExpression is not None and not _matches(self.items.get(Item[self.key], {}), ConditionExpression):
+                raise FakeConditionalCheckFailed()
+            self.items[Item[self.key]] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get(Key[self.key])
+        return {'Item': _project(item, kwargs)} if item is not None else {}
+
+    def delete_item(self, Key, **kwargs):
+        self.items.pop(Key[self.key], None)
+        return {}
+
+    def scan(self, FilterExpression=None, **kwargs):
+        # Like DynamoDB, a scan reads every item in the table before filtering
+        items = [item for item in self.items.values() if FilterExpression is None or _matches(item, FilterExpression)]
+        return {'Items': copy.deepcopy(items), 'Count': len(items), 'ScannedCount': len(self.items)}
+
+
+class FakeDynamoDB:
+    """
+    Minimal stand-in for the boto3 DynamoDB service resource.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tables = {}
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name)
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        _wait(self.latency)
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.Table(table_name)
+            found = []
+            for key in request['Keys']:
+                item = table.items.get(key[table.key])
+                if item is not None:
+                    found.append(_project(item, request))
+            responses[table_name] = found
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class FakeSQS:
+    """
+    Minimal stand-in for the boto3 SQS client, a single in-memory queue.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Condition()
+        self.visible = deque()
+        self.in_flight = {}
+        self.deleted = 0
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        _wait(self.latency)
+        message_id = str(uuid.uuid4())
+        with self.lock:
+            self.visible.append({'MessageId': message_id, 'Body': MessageBody})
+            self.lock.notify_all()
+        return {'MessageId': message_id}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, **kwargs):
+        _wait(self.latency)
+        messages = []
+        with self.lock:
+            # Long polling returns as soon as a message arrives
+            if not self.visible and WaitTimeSeconds:
+                self.lock.wait_for(lambda: self.visible, timeout=WaitTimeSeconds)
+            while self.visible and len(messages) < MaxNumberOfMessages:
+                message = dict(self.visible.popleft(), ReceiptHandle=str(uuid.uuid4()))
+                self.in_flight[message['ReceiptHandle']] = message
+                messages.append(message)
+        return {'Messages': messages} if messages else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle, **kwargs):
+        _wait(self.latency)
+        with self.lock:
+            if self.in_flight.pop(ReceiptHandle, None) is not None:
+                self.deleted += 1
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries, **kwargs):
+        _wait(self.latency)
+        successful = []
+        with self.lock:
+            for entry in Entries:
+                if self.in_flight.pop(entry['ReceiptHandle'], None) is not None:
+                    self.deleted += 1
+                successful.append({'Id': entry['Id']})
+        return {'Successful': successful, 'Failed': []}
+
+    def release_in_flight(self):
+        # Makes undeleted messages visible again, as if their visibility timeout expired
+        with self.lock:
+            for message in self.in_flight.values():
+                self.visible.append({'MessageId': message['MessageId'], 'Body': message['Body']})
+            self.in_flight.clear()
+            self.lock.notify_all()
+
+    def pending(self):
+        with self.lock:
+            return len(self.visible) + len(self.in_flight)
+
+
+class FakeContext:
+    """
+    Lambda context with a deadline, for the handlers that budget their work on the remaining time.
+    """
+
+    def __init__(self, timeout_millis=60000):
+        self.deadline = time.monotonic() + timeout_millis / 1000
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class FakeSendGridResponse:
+
+    def __init__(self):
+        self.status_code = 202
+        self.body = b''
+
+
+class FakeSendGrid:
+    """
+    Stand-in for SendGridAPIClient, records the sent mails.
+    """
+
+    latency = 0.0
+    sent = []
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+
+    def send(self, message):
+        _wait(self.latency)
+        FakeSendGrid.sent.append(message.get() if hasattr(message, 'get') else message)
+        return FakeSendGridResponse()
+
+
+class FakeSNS:
+    """
+    Stand-in for the boto3 SNS client, records the published messages.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.published = []
+
+    def publish(self, **kwargs):
+        _wait(self.latency)
+        self.published.append(kwargs)
+        return {'MessageId': str(uuid.uuid4())}
+
+
+class FakeLexRuntime:
+    """
+    Stand-in for the lexv2-runtime client, echoes the text back and counts the turns of every session.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.turns = {}
+
+    def recognize_text(self, botId, botAliasId, localeId, sessionId, text, **kwargs):
+        _wait(self.latency)
+        with self.lock:
+            self.turns[sessionId] = self.turns.get(sessionId, 0) + 1
+            turn = self.turns[sessionId]
+        return {
+            'sessionId': sessionId,
+            'messages': [{'contentType': 'PlainText', 'content': 'Turn {}: {}'.format(turn, text)}]
+        }
+
+
+class FakeIndices:
+
+    def __init__(self, es):
+        self.es = es
+        self.settings = {}
+
+    def exists(self, index, **kwargs):
+        return index in self.settings
+
+    def create(self, index, body=None, **kwargs):
+        self.settings.setdefault(index, {})
+        return {'acknowledged': True}
+
+    def get_settings(self, index, name=None, **kwargs):
+        settings = self.settings.get(index, {})
+        return {index: {'settings': {'index': settings}}} if settings else {}
+
+    def put_settings(self, index, body, **kwargs):
+        settings = self.settings.setdefault(index, {})
+        for key, value in body['index'].items():
+            if value is None:
+                settings.pop(key, None)
+            else:
+                settings[key] = value
+        return {'acknowledged': True}
+
+    def refresh(self, index=None, **kwargs):
+        _wait(self.es.refresh_latency)
+        return {}
+
+
+class FakeElasticSearch:
+    """
+    Stand-in for the Elasticsearch client and the restaurants index.
+    Every request costs `latency`, every forced refresh costs `refresh_latency` on top.
+    """
+
+    def __init__(self, latency=0.0, refresh_latency=0.0):
+        self.latency = latency
+        self.refresh_latency = refresh_latency
+        self.lock = threading.Lock()
+        self.documents = {}
+        self.requests = 0
+        self.indices = FakeIndices(self)
+
+    def index(self, index=None, id=None, body=None, doc_type=None, refresh=False, **kwargs):
+        _wait(self.latency)
+        with self.lock:
+            self.requests += 1
+            self.documents[id] = body
+        if refresh:
+            self.indices.refresh(index=index)
+        return {'_id': id, 'result': 'created'}
+
+    def bulk(self, body, index=None, doc_type=None, **kwargs):
+        _wait(self.latency)
+        lines = body.decode('utf-8').splitlines() if isinstance(body, bytes) else body.splitlines()
+        items = []
+        lines = iter(lines)
+        with self.lock:
+            self.requests += 1
+            for action_line in lines:
+                operation, action = next(iter(json.loads(action_line).items()))
+                if operation == 'delete':
+                    found = self.documents.pop(action['_id'], None) is not None
+                    items.append({'delete': {'_id': action['_id'], 'status': 200 if found else 404}})
+                else:
+                    self.documents[action['_id']] = json.loads(next(lines))
+                    items.append({operation: {'_id': action['_id'], 'status': 201}})
+        return {'errors': False, 'items': items}
+
+    def _search(self, query):
+        # Evaluates the function_score / term query lf2 sends, random_score orders by a hash of the seed and id
+        function_score = query['query']['function_score']
+        term = function_score['query']['term']['categories'].lower()
+        seed = function_score.get('random_score', {}).get('seed', 0)
+        hits = [{'_id': id, '_source': {field: document[field] for field in query.get('_source', document) if field in document}}
+                for id, document in self.documents.items() if term in document.get('categories', '').lower().split()]
+        hits.sort(key=lambda hit: zlib.crc32('{}:{}'.format(seed, hit['_id']).encode('utf-8')))
+        return {'hits': {'total': {'value': len(hits)}, 'hits': hits[:query.get('size', 10)]}}
+
+    def msearch(self, body):
+        _wait(self.latency)
+        with self.lock:
+            self.requests += 1
+        lines = body.splitlines()
+        return {'responses': [self._search(json.loads(query_line)) for query_line in lines[1::2]]}
+
+
+class FakeHTTPResponse:
+
+    def __init__(self, document, status_code=200):
+        self.status_code = status_code
+        self.content = json.dumps(document).encode('utf-8')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError('HTTP {}'.format(self.status_code))
+
+
+class FakeElasticSearchSession:
+    """
+    Stand-in for clients.es_session, answers the _msearch requests of lf2 from a FakeElasticSearch.
+    """
+
+    def __init__(self, es):
+        self.es = es
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        if not url.endswith('_msearch'):
+            raise NotImplementedError('Unsupported request {}'.format(url))
+        return FakeHTTPResponse(self.es.msearch(data))
@@ -0,0 +1,242 @@
+"""
+End-to-end load test of the lf1 -> SQS -> lf2 pipeline, entirely in process.
+
+Synthetic users hold a full Lex V2 conversation with lf1 (one dialog code hook per slot, then fulfillment),
+lf1 enqueues the request on an in-memory SQS stand-in, and lf2 drains it against DynamoDB, Elasticsearch
+and SendGrid stand-ins with configurable latency. Reports throughput, latency percentiles and the
+per-stage breakdown recorded by the metrics module, and compares them with a stored baseline.
+
+    python benchmarks/loadtest.py --users 200 --save-baseline benchmarks/loadtest-baseline.json
+    python benchmarks/loadtest.py --users 200 --baseline benchmarks/loadtest-baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+import contextlib
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+lambdas_dir = os.path.join(benchmarks_dir, '..')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('DYNAMODB_TABLE', 'yelp-restaurants')
+os.environ.setdefault('SQS_URL', 'https://sqs.us-east-1.amazonaws.com/000000000000/loadtest')
+os.environ['LOG_SAMPLE_RATE'] = '0'
+sys.path.insert(0, os.path.join(lambdas_dir, 'shared'))
+
+from fakes import (FakeContext, FakeDynamoDB, FakeElasticSearch, FakeElasticSearchSession, FakeSendGrid, FakeSNS,
+                   FakeSQS, cuisines, lex_event)
+import clients
+import metrics
+
+""" --- Constants --- """
+restaurants_per_cuisine = 200
+slot_order = ['location', 'cuisine', 'numberOfPpl', 'date', 'time', 'phoneNumber', 'emailAddress']
+
+
+def load_handler(name, directory):
+    # lf1 and lf2 are both called lambda_function, each is loaded under its own name
+    sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(directory, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def summarize(values):
+    ordered = sorted(values)
+    if not ordered:
+        return {'count': 0, 'p50': 0, 'p95': 0, 'p99': 0}
+    return {'count': len(ordered),
+            'p50': round(metrics.percentile(ordered, 50), 3),
+            'p95': round(metrics.percentile(ordered, 95), 3),
+            'p99': round(metrics.percentile(ordered, 99), 3)}
+
+
+class Pipeline:
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.stage_timings = {}
+        self.enqueued_at = {}
+        self.delivered_at = {}
+        self.turn_millis = []
+
+        self.sqs = FakeSQS(latency=args.sqs_latency_ms / 1000)
+        self.sns = FakeSNS()
+        self.dynamodb = FakeDynamoDB()
+        self.es = FakeElasticSearch()
+        self.sendgrid = self.recording_sendgrid(args.sendgrid_latency_ms / 1000)
+        self.populate()
+        self.dynamodb.latency = args.dynamodb_latency_ms / 1000
+        self.es.latency = args.es_latency_ms / 1000
+
+        services = {'sqs': self.sqs, 'sns': self.sns}
+        clients.client = lambda service_name: services[service_name]
+        clients.resource = lambda service_name: self.dynamodb
+        clients.sendgrid_client = lambda api_key: self.sendgrid
+        clients.es_session = lambda region, service='es': FakeElasticSearchSession(self.es)
+        self.record_stages()
+
+        self.lf1 = load_handler('lf1_lambda_function', os.path.join(lambdas_dir, 'lf1'))
+        self.lf2 = load_handler('lf2_lambda_function', os.path.join(lambdas_dir, 'lf2'))
+        self.lf2.max_wait_time_seconds = 1
+        if not args.snapshot:
+            self.lf2.snapshot = None
+
+    def populate(self):
+        table = self.dynamodb.Table(os.environ['DYNAMODB_TABLE'])
+        for cuisine in cuisines:
+            for i in range(restaurants_per_cuisine):
+                id = '{}-{}'.format(cuisine, i)
+                table.put_item(Item={'id': id, 'name': 'Restaurant {}'.format(id), 'address': '{} Broadway'.format(i),
+                                     'rating': str(random.choice([3.5, 4.0, 4.5])), 'review_count': str(random.randint(1, 3000))})
+                self.es.index(index='restaurants', id=id, body={'id': id, 'categories': cuisine})
+
+    def recording_sendgrid(self, latency):
+        pipeline = self
+
+        class RecordingSendGrid(FakeSendGrid):
+
+            def send(self, message):
+                response = super().send(message)
+                now = time.perf_counter()
+                with pipeline.lock:
+                    for personalization in message.get()['personalizations']:
+                        for to in personalization['to']:
+                            pipeline.delivered_at.setdefault(to['email'], now)
+                return response
+
+        RecordingSendGrid.latency = latency
+        RecordingSendGrid.sent = []
+        return RecordingSendGrid()
+
+    def record_stages(self):
+        record = metrics.record
+
+        def recording(stage, millis):
+            with self.lock:
+                self.stage_timings.setdefault(stage, []).append(millis)
+            record(stage, millis)
+
+        metrics.record = recording
+
+    def converse(self, user):
+        tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+        answers = {'location': 'Manhattan', 'cuisine': cuisines[user % len(cuisines)], 'numberOfPpl': str(2 + user % 10),
+                   'date': tomorrow, 'time': '19:30', 'phoneNumber': '212555{:04d}'.format(user % 10000),
+                   'emailAddress': 'user{}@example.com'.format(user)}
+        values = {slot: None for slot in slot_order}
+        session_attributes = {}
+        session_id = 'loadtest-{}'.format(user)
+        turns = []
+
+        for slot in [None] + slot_order:
+            if slot is not None:
+                values[slot] = answers[slot]
+            start = time.perf_counter()
+            result = self.lf1.lambda_handler(lex_event(values, session_attributes=session_attributes, session_id=session_id), None)
+            turns.append((time.perf_counter() - start) * 1000)
+            session_attributes = result['sessionState']['sessionAttributes']
+
+        start = time.perf_counter()
+        self.lf1.lambda_handler(lex_event(values, 'FulfillmentCodeHook', session_attributes, session_id), None)
+        now = time.perf_counter()
+        turns.append((now - start) * 1000)
+
+        with self.lock:
+            self.turn_millis.extend(turns)
+            self.enqueued_at[answers['emailAddress']] = now
+
+    def drain(self, producers_done):
+        while not (producers_done.is_set() and not self.sqs.visible):
+            self.lf2.lambda_handler({}, FakeContext(self.args.lf2_timeout_ms))
+
+    def run(self):
+        producers_done = threading.Event()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            drainers = [threading.Thread(target=self.drain, args=(producers_done,)) for _ in range(self.args.lf2_concurrency)]
+            for drainer in drainers:
+                drainer.start()
+            with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+                list(executor.map(self.converse, range(self.args.users)))
+            producers_done.set()
+            for drainer in drainers:
+                drainer.join()
+            duration = time.perf_counter() - start
+
+        end_to_end = [(self.delivered_at[email] - enqueued) * 1000
+                      for email, enqueued in self.enqueued_at.items() if email in self.delivered_at]
+        return {
+            'users': self.args.users,
+            'delivered': len(end_to_end),
+            'duration_seconds': round(duration, 3),
+            'throughput_rps': round(len(end_to_end) / duration, 2),
+            'lf1_turn_ms': summarize(self.turn_millis),
+            'end_to_end_ms': summarize(end_to_end),
+            'stages': {stage: dict(summarize(values), total=round(sum(values), 3))
+                       for stage, values in sorted(self.stage_timings.items())}
+        }
+
+
+def change(current, baseline):
+    if not baseline:
+        return ''
+    return '{:+.1f}%'.format((current - baseline) / baseline * 100)
+
+
+def report(summary, baseline=None):
+    baseline = baseline or {}
+    print('users {users}, delivered {delivered} in {duration_seconds}s'.format(**summary))
+    print('{:<24} {:>12} {:>10}'.format('throughput requests/sec', summary['throughput_rps'],
+                                       change(summary['throughput_rps'], baseline.get('throughput_rps'))))
+    print()
+    print('{:<24} {:>8} {:>10} {:>10} {:>10} {:>10}'.format('latency ms', 'count', 'p50', 'p95', 'p99', 'p95 vs base'))
+    rows = [('lf1 turn', summary['lf1_turn_ms'], baseline.get('lf1_turn_ms', {})),
+            ('end to end', summary['end_to_end_ms'], baseline.get('end_to_end_ms', {}))]
+    rows += [('  ' + stage, values, baseline.get('stages', {}).get(stage, {})) for stage, values in summary['stages'].items()]
+    for name, values, base in rows:
+        print('{:<24} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10}'.format(
+            name, values['count'], values['p50'], values['p95'], values['p99'], change(values['p95'], base.get('p95'))))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20, help='users talking to lf1 at once')
+    parser.add_argument('--lf2-concurrency', type=int, default=1, help='lf2 invocations draining at once')
+    parser.add_argument('--lf2-timeout-ms', type=int, default=60000)
+    parser.add_argument('--sqs-latency-ms', type=float, default=2)
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=5)
+    parser.add_argument('--es-latency-ms', type=float, default=20)
+    parser.add_argument('--sendgrid-latency-ms', type=float, default=100)
+    parser.add_argument('--snapshot', action='store_true', help='let lf2 use its restaurant snapshot if one is built')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='compare with a summary saved by --save-baseline')
+    parser.add_argument('--save-baseline', help='write the summary of this run as JSON')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    summary = Pipeline(args).run()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(summary, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        print('Saved baseline to {}'.format(args.save_baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Loads only what changed in Restaurants.csv since the last run into both DynamoDB and Elasticsearch.
+
+Every restaurant row is hashed and compared with a local manifest of the hashes loaded last time.
+After one streaming pass new and changed restaurants are upserted into both stores, and restaurants that are no longer
+in the file are deleted from both. The manifest is only updated for the writes that succeeded, so failures are
+retried on the next run. Without a manifest every restaurant is new, which makes the first run a full load.
+
+    python catalog-delta-load.py --csv Restaurants.csv --manifest restaurants.manifest.json
+    python catalog-delta-load.py --csv Restaurants.csv --denormalised --es-host localhost --es-port 9200 --local
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import importlib.util
+
+""" --- Constants --- """
+directory = os.path.dirname(os.path.abspath(__file__))
+default_manifest = 'restaurants.manifest.json'
+field_separator = '\x1f'
+
+
+def load_script(name, filename):
+    # The loaders are scripts with hyphenated names, they are loaded by path to reuse their helpers
+    spec = importlib.util.spec_from_file_location(name, os.path.join(directory, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+dynamodb_loader = load_script('dynamodb_loader', 'dynamodb-data-upload.py')
+es_loader = load_script('es_loader', 'elastic-search-data-inject.py')
+
+
+def row_hash(restaurant):
+    return hashlib.blake2b(field_separator.join(restaurant).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(temporary_path, path)
+
+
+class DynamoDBSink:
+    """
+    Batched puts and deletes against the restaurants table.
+    """
+
+    def __init__(self, table):
+        self.batch = table.batch_writer(overwrite_by_pkeys=['id'])
+        self.batch.__enter__()
+
+    def upsert(self, restaurant):
+        self.batch.put_item(Item=dynamodb_loader.table_entry(restaurant))
+
+    def delete(self, id):
+        self.batch.delete_item(Key={'id': id})
+
+    def close(self):
+        """
+        Flushes the remaining writes. Returns the ids whose writes failed.
+        """
+        # batch_writer retries unprocessed items itself, anything else fails the whole flush
+        self.batch.__exit__(None, None, None)
+        return set()
+
+
+class ElasticsearchSink:
+    """
+    Index and delete actions streamed into _bulk requests of at most max_bytes.
+    """
+
+    def __init__(self, es, denormalised=False, max_bytes=es_loader.max_chunk_bytes):
+        self.es = es
+        self.denormalised = denormalised
+        self.max_bytes = max_bytes
+        self.chunk = []
+        self.ids = []
+        self.size = 0
+        self.chunks = 0
+        self.failed = set()
+        if not es.indices.exists(index=es_loader.index):
+            es.indices.create(index=es_loader.index, body=es_loader.index_mapping)
+
+    def _add(self, id, action):
+        if self.chunk and self.size + len(action) > self.max_bytes:
+            self._send()
+        self.chunk.append(action)
+        self.ids.append(id)
+        self.size += len(action)
+
+    def _send(self):
+        _, errors = es_loader.send_chunk(self.es, self.chunks, b''.join(self.chunk), len(self.chunk))
+        for error in errors:
+            # A failed request fails all of its documents, otherwise only the failed items
+            if 'id' in error:
+                self.failed.add(error['id'])
+            else:
+                self.failed.update(self.ids)
+        self.chunks += 1
+        self.chunk = []
+        self.ids = []
+        self.size = 0
+
+    def upsert(self, restaurant):
+        self._add(restaurant[0], next(es_loader.bulk_actions([restaurant], self.denormalised)))
+
+    def delete(self, id):
+        action = {'delete': {'_index': es_loader.index, '_id': id}}
+        self._add(id, (json.dumps(action) + '\n').encode('utf-8'))
+
+    def close(self):
+        """
+        Sends the last chunk and makes the changes searchable. Returns the ids whose writes failed.
+        """
+        if self.chunk:
+            self._send()
+        self.es.indices.refresh(index=es_loader.index)
+        return self.failed
+
+
+def delta_load(restaurants, manifest, sinks):
+    """
+    Applies the difference between the restaurants and the manifest to every sink.
+    The catalog lists a restaurant once per cuisine it was scraped for. Like the full loaders, which overwrite by id,
+    the last row of an id wins, so only rows that differ from the manifest are held until the end of the file.
+    Returns (the new manifest, a dict of counts).
+    """
+    seen = {}
+    changed = {}
+    for restaurant in restaurants:
+        id = restaurant[0]
+        seen[id] = row_hash(restaurant)
+        if manifest.get(id) != seen[id]:
+            changed[id] = restaurant
+        else:
+            changed.pop(id, None)
+
+    counts = {'added': 0, 'changed': 0, 'unchanged': len(seen) - len(changed), 'removed': 0, 'failed': 0}
+    for id, restaurant in changed.items():
+        counts['changed' if id in manifest else 'added'] += 1
+        for sink in sinks:
+            sink.upsert(restaurant)
+
+    removed = [id for id in manifest if id not in seen]
+    counts['removed'] = len(removed)
+    for id in removed:
+        for sink in sinks:
+            sink.delete(id)
+
+    failed = set()
+    for sink in sinks:
+        failed.update(sink.close())
+    counts['failed'] = len(failed)
+
+    # A failed write keeps the hash that was loaded before it, so the next run tries again
+    new_manifest = {}
+    for id, digest in seen.items():
+        if id not in failed:
+            new_manifest[id] = digest
+        elif id in manifest:
+            new_manifest[id] = manifest[id]
+    for id in removed:
+        if id in failed:
+            new_manifest[id] = manifest[id]
+    return new_manifest, counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', default='Restaurants.csv')
+    parser.add_argument('--manifest', default=default_manifest)
+    parser.add_argument('--es-host', default=es_loader.host)
+    parser.add_argument('--es-port', type=int, default=443)
+    parser.add_argument('--local', action='store_true', help='plain HTTP without SigV4, for a local ES-compatible server')
+    parser.add_argument('--denormalised', action='store_true', help='also index name, address, rating, review_count and zip_code')
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.manifest)
+    sinks = [DynamoDBSink(dynamodb_loader.create_table()),
+             ElasticsearchSink(es_loader.create_client(args.es_host, args.es_port, args.local), args.denormalised)]
+
+    start = time.perf_counter()
+    new_manifest, counts = delta_load(es_loader.read_restaurants(args.csv), manifest, sinks)
+    save_manifest(args.manifest, new_manifest)
+
+    print('Added {added}, changed {changed}, removed {removed}, unchanged {unchanged}, failed {failed}'.format(**counts))
+    print('Finished in {:.2f}s'.format(time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
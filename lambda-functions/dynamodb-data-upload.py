@@ -1,38 +1,122 @@
+"""
+Uploads restaurants.csv into the yelp-restaurants DynamoDB table.
+The file is split into byte ranges, one per worker, and each worker streams its rows into 25-item batch writes.
+Rows are assumed not to contain quoted line breaks, so that every line of the file is one restaurant.
+For refreshes of an already loaded catalog, catalog-delta-load.py writes only the rows that changed.
+
+    python dynamodb-data-upload.py --csv restaurants.csv --workers 4
+"""
 import boto3
 import datetime
 import csv
-from decimal import Decimal
-import json
-from botocore.vendored import requests
-
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-table = dynamodb.Table('yelp-restaurants')
-
-with open('restaurants.csv', newline='') as f:
-    reader=csv.reader(f)
-    restaurants=list(reader)
-restaurants=restaurants[1:]
-
-for restaurant in restaurants:
-    if restaurant[6] == '':
-        print(restaurant[0])
-    tableEntry = {
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait
+from botocore.config import Config
+
+""" --- Constants --- """
+region = 'us-east-1'
+table_name = 'yelp-restaurants'
+default_workers = 4
+max_attempts = 10
+log_interval_seconds = 5
+
+
+def create_table(region_name=region):
+    # Adaptive retries rate limit the client when DynamoDB throttles, instead of retrying at full speed
+    config = Config(retries={'mode': 'adaptive', 'max_attempts': max_attempts})
+    dynamodb = boto3.session.Session().resource('dynamodb', region_name=region_name, config=config)
+    return dynamodb.Table(table_name)
+
+
+def file_partitions(path, partitions):
+    """
+    Splits the file, minus its header line, into byte ranges that start and end on line boundaries.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        boundaries = [f.tell()]
+        data_start = boundaries[0]
+        for i in range(1, partitions):
+            f.seek(max(data_start, size * i // partitions))
+            f.readline()
+            boundaries.append(max(f.tell(), boundaries[-1]))
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def read_partition(path, start, end):
+    def lines():
+        with open(path, 'rb') as f:
+            f.seek(start)
+            position = start
+            while position < end:
+                line = f.readline()
+                if not line:
+                    break
+                position += len(line)
+                yield line.decode('utf-8')
+
+    return csv.reader(lines())
+
+
+def table_entry(restaurant):
+    return {
+        'insertedAtTimestamp': str(datetime.datetime.now()),
         'id': restaurant[0],
         'name': restaurant[1],
         'address': restaurant[2],
         'coordinates': restaurant[3],
         'review_count': restaurant[4],
-        'rating': restaurants[1][5],
+        'rating': restaurant[5],
         'zip_code': restaurant[6],
         'cuisine': restaurant[7]
     }
-table.put_item(Item={'insertedAtTimestamp': str(datetime.datetime.now()),
-            'id': tableEntry['id'],
-            'name': tableEntry['name'],
-            'address': tableEntry['address'],
-            'rating': tableEntry['rating'],
-            'review_count': tableEntry['review_count'],
-            'coordinates': tableEntry['coordinates'],
-            'zip_code': tableEntry['zip_code'],
-            'cuisine': tableEntry['cuisine']
-})
+
+
+def write_partition(table, path, start, end, progress, worker):
+    with table.batch_writer(overwrite_by_pkeys=['id']) as batch:
+        for restaurant in read_partition(path, start, end):
+            if restaurant[6] == '':
+                print('Missing zip code-> {}'.format(restaurant[0]))
+            batch.put_item(Item=table_entry(restaurant))
+            progress[worker] += 1
+    return progress[worker]
+
+
+def upload(path, workers=default_workers, table_factory=create_table):
+    """
+    Uploads the file with one worker per partition and logs the overall items/sec while it runs.
+    Returns (number of items written, elapsed seconds).
+    """
+    partitions = file_partitions(path, workers)
+    progress = [0] * len(partitions)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(partitions) or 1) as executor:
+        # Each worker gets its own table resource, boto3 resources are not thread safe
+        futures = [executor.submit(write_partition, table_factory(), path, partition_start, partition_end, progress, worker)
+                   for worker, (partition_start, partition_end) in enumerate(partitions)]
+        pending = futures
+        while pending:
+            _, pending = wait(pending, timeout=log_interval_seconds)
+            elapsed = time.perf_counter() - start
+            print('Uploaded {} items ({:.0f} items/sec)'.format(sum(progress), sum(progress) / elapsed if elapsed else 0))
+        written = sum(future.result() for future in futures)
+
+    return written, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', default='restaurants.csv')
+    parser.add_argument('--workers', type=int, default=default_workers)
+    args = parser.parse_args()
+
+    written, elapsed = upload(args.csv, args.workers)
+    print('Uploaded {} items in {:.2f}s ({:.0f} items/sec)'.format(written, elapsed, written / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
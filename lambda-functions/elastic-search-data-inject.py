@@ -1,30 +1,209 @@
+"""
+Loads Restaurants.csv into the restaurants Elasticsearch index.
+The CSV is streamed into _bulk requests capped by size in bytes, several of which are in flight at once,
+with index refreshes turned off for the duration of the load.
+With --denormalised the documents also carry the fields lf2 shows in its suggestions, so it can answer
+from the search hits without a DynamoDB lookup.
+For refreshes of an already loaded catalog, catalog-delta-load.py writes only the rows that changed.
+
+    python elastic-search-data-inject.py --csv Restaurants.csv
+    python elastic-search-data-inject.py --csv Restaurants.csv --denormalised
+    python elastic-search-data-inject.py --host localhost --port 9200 --local
+"""
 import boto3
 import json
-from botocore.vendored import requests
+import time
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from elasticsearch import Elasticsearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
 import csv
 
-host = {ES_HOST_URL}
+""" --- Constants --- """
+host = os.environ.get('ES_HOST_URL')
 region = 'us-east-1'
 service = 'es'
-credentials = boto3.Session().get_credentials()
-awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, region, service, session_token=credentials.token)
-
-es = Elasticsearch(
-    hosts = [{'host': host, 'port': 443}],
-    http_auth = awsauth,
-    use_ssl = True,
-    verify_certs = True,
-    connection_class = RequestsHttpConnection
-)
-print(es)
-with open('Restaurants.csv', newline='') as f:
-    reader = csv.reader(f)
-    restaurants = list(reader)
-
-for restaurant in restaurants:
-    index_data={'id': restaurant[0],'categories': restaurant[7]}
-    print ('dataObject',index_data)
-
-    es.index(index="restaurants", doc_type="Restaurant", id=restaurant[0], body=index_data, refresh=True)
+index = 'restaurants'
+doc_type = 'Restaurant'
+max_chunk_bytes = 5 * 1024 * 1024
+max_in_flight = 4
+# Display fields are stored for lf2 to return, only categories is searched
+index_mapping = {
+    'mappings': {
+        doc_type: {
+            'properties': {
+                'id': {'type': 'keyword'},
+                'categories': {'type': 'text'},
+                'name': {'type': 'keyword', 'index': False},
+                'address': {'type': 'keyword', 'index': False},
+                'rating': {'type': 'float', 'index': False},
+                'review_count': {'type': 'integer', 'index': False},
+                'zip_code': {'type': 'keyword', 'index': False}
+            }
+        }
+    }
+}
+
+
+def create_client(host, port=443, local=False):
+    if local:
+        return Elasticsearch(hosts=[{'host': host, 'port': port}])
+
+    credentials = boto3.Session().get_credentials()
+    awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, region, service, session_token=credentials.token)
+
+    return Elasticsearch(
+        hosts = [{'host': host, 'port': port}],
+        http_auth = awsauth,
+        use_ssl = True,
+        verify_certs = True,
+        connection_class = RequestsHttpConnection
+    )
+
+
+def read_restaurants(path):
+    # Rows are yielded one at a time so the whole file is never held in memory
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for restaurant in reader:
+            yield restaurant
+
+
+def parse_number(value, cast):
+    try:
+        return cast(value)
+    except ValueError:
+        return None
+
+
+def search_document(restaurant, denormalised=False):
+    index_data = {'id': restaurant[0], 'categories': restaurant[7]}
+    if denormalised:
+        index_data.update({
+            'name': restaurant[1],
+            'address': restaurant[2],
+            'rating': parse_number(restaurant[5], float),
+            'review_count': parse_number(restaurant[4], int),
+            'zip_code': restaurant[6]
+        })
+    return index_data
+
+
+def bulk_actions(restaurants, denormalised=False):
+    for restaurant in restaurants:
+        index_data = search_document(restaurant, denormalised)
+        action = {'index': {'_index': index, '_id': restaurant[0]}}
+        yield (json.dumps(action) + '\n' + json.dumps(index_data) + '\n').encode('utf-8')
+
+
+def chunk_actions(actions, max_bytes=max_chunk_bytes):
+    """
+    Groups the serialised actions into _bulk bodies of at most max_bytes.
+    Yields (body, number of documents).
+    """
+    chunk = []
+    size = 0
+    for action in actions:
+        if chunk and size + len(action) > max_bytes:
+            yield b''.join(chunk), len(chunk)
+            chunk = []
+            size = 0
+        chunk.append(action)
+        size += len(action)
+    if chunk:
+        yield b''.join(chunk), len(chunk)
+
+
+def send_chunk(es, chunk_number, body, count):
+    """
+    Sends one _bulk request. Returns (number of documents indexed, list of errors).
+    """
+    try:
+        response = es.bulk(body=body, index=index, doc_type=doc_type)
+    except Exception as e:
+        print('Chunk {} of {} documents failed-> {}'.format(chunk_number, count, e))
+        return 0, [{'chunk': chunk_number, 'documents': count, 'error': str(e)}]
+
+    errors = []
+    if response.get('errors'):
+        for item in response['items']:
+            result = next(iter(item.values()))
+            if 'error' in result:
+                errors.append({'chunk': chunk_number, 'id': result.get('_id'), 'error': result['error']})
+        print('Chunk {} had {} errors out of {} documents'.format(chunk_number, len(errors), count))
+    return count - len(errors), errors
+
+
+def get_refresh_interval(es):
+    settings = es.indices.get_settings(index=index, name='index.refresh_interval')
+    return settings.get(index, {}).get('settings', {}).get('index', {}).get('refresh_interval')
+
+
+def set_refresh_interval(es, refresh_interval):
+    es.indices.put_settings(index=index, body={'index': {'refresh_interval': refresh_interval}})
+
+
+def load(es, restaurants, max_bytes=max_chunk_bytes, in_flight=max_in_flight, denormalised=False):
+    """
+    Indexes the restaurants with parallel _bulk requests.
+    Returns (number of documents sent, number indexed, list of errors, elapsed seconds).
+    """
+    if not es.indices.exists(index=index):
+        es.indices.create(index=index, body=index_mapping)
+    previous_refresh_interval = get_refresh_interval(es)
+    set_refresh_interval(es, '-1')
+
+    sent = 0
+    indexed = 0
+    errors = []
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=in_flight) as executor:
+            pending = set()
+            for chunk_number, (body, count) in enumerate(chunk_actions(bulk_actions(restaurants, denormalised), max_bytes)):
+                # Bound the number of chunks held in memory to the number of requests in flight
+                if len(pending) >= in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        chunk_indexed, chunk_errors = future.result()
+                        indexed += chunk_indexed
+                        errors.extend(chunk_errors)
+                pending.add(executor.submit(send_chunk, es, chunk_number, body, count))
+                sent += count
+
+            for future in pending:
+                chunk_indexed, chunk_errors = future.result()
+                indexed += chunk_indexed
+                errors.extend(chunk_errors)
+    finally:
+        # None resets the interval to the index default
+        set_refresh_interval(es, previous_refresh_interval)
+        es.indices.refresh(index=index)
+
+    return sent, indexed, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', default='Restaurants.csv')
+    parser.add_argument('--host', default=host)
+    parser.add_argument('--port', type=int, default=443)
+    parser.add_argument('--local', action='store_true', help='plain HTTP without SigV4, for a local ES-compatible server')
+    parser.add_argument('--max-chunk-bytes', type=int, default=max_chunk_bytes)
+    parser.add_argument('--in-flight', type=int, default=max_in_flight)
+    parser.add_argument('--denormalised', action='store_true', help='also index name, address, rating, review_count and zip_code')
+    args = parser.parse_args()
+
+    es = create_client(args.host, args.port, args.local)
+    sent, indexed, errors, elapsed = load(es, read_restaurants(args.csv), args.max_chunk_bytes, args.in_flight, args.denormalised)
+
+    print('Indexed {} of {} documents with {} errors in {:.2f}s ({:.0f} docs/sec)'.format(
+        indexed, sent, len(errors), elapsed, indexed / elapsed if elapsed else 0))
+    for error in errors[:20]:
+        print('Error-> {}'.format(error))
+
+
+if __name__ == '__main__':
+    main()
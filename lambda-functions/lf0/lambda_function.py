@@ -1,32 +1,131 @@
-import boto3
 import os
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import clients
+import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
 
 """ --- Constants --- """
 botId = os.environ.get('BOT_ID')
 botAliasId = os.environ.get('BOT_ALIAS_ID')
 localeId = 'en_US'
-sessionId = 'test_session'
+max_workers = int(os.environ.get('MAX_WORKERS', '25'))
+time_budget_millis = int(os.environ.get('LEX_TIME_BUDGET_MILLIS', '25000'))
+safety_margin_millis = 500
+# Lex V2 session ids are 2 to 100 characters from this set
+invalid_session_chars = re.compile(r'[^0-9a-zA-Z._:-]')
+timeout_reply = 'Sorry, that took me too long. Could you say that again?'
+error_reply = 'Oops, something went wrong. Please try again.'
+# Old cached pages send no session id, a new page sends one with every message
+unidentified_reply = 'Sorry, I lost track of our conversation. Please reload the page and try again.'
 
 
-def lambda_handler(event, context):
-    # Lex client uses 'lexv2-runtime'
-    client = boto3.client('lexv2-runtime')
+def get_session_id(event, message):
+    """
+    Each user or connection gets its own Lex session, so concurrent conversations do not share dialog state.
+    Returns None when nothing identifies the user. The source IP is not used, users behind one NAT share it.
+    """
+    request_context = event.get('requestContext') or {}
+    identity = request_context.get('identity') or {}
+    session_id = (message.get('sessionId')
+                  or event.get('sessionId')
+                  or request_context.get('connectionId')
+                  or identity.get('cognitoIdentityId'))
+    if not session_id:
+        return None
+    session_id = invalid_session_chars.sub('-', str(session_id))[:100]
+    return session_id if len(session_id) >= 2 else session_id + '--'
+
 
-    message = event['messages'][0]['unstructured']['text']
-    print(message)
+def recognize_text(session_id, text):
+    # Lex client uses 'lexv2-runtime', created once per container
+    client = clients.client('lexv2-runtime')
 
     # Send the message to the lex using the recognize_text function
-    response = client.recognize_text(
-        botId=botId,
-        botAliasId=botAliasId,
-        localeId=localeId,
-        sessionId=sessionId,
-        text=message
-    )
+    with metrics.timer('lex'):
+        response = client.recognize_text(
+            botId=botId,
+            botAliasId=botAliasId,
+            localeId=localeId,
+            sessionId=session_id,
+            text=text
+        )
+
+    metrics.log_sampled('Lex Response', response)
+    messages = response.get('messages') or []
+    return messages[0]['content'] if messages else error_reply
+
+
+def converse(turns):
+    """
+    Sends the turns of one session to Lex one after another, keeping their order within the conversation.
+    """
+    return [recognize_text(session_id, text) for session_id, text in turns]
+
+
+def get_time_budget_seconds(context):
+    budget = time_budget_millis
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        budget = min(budget, context.get_remaining_time_in_millis() - safety_margin_millis)
+    return max(budget, 0) / 1000
+
+
+def lambda_handler(event, context):
+    try:
+        return handle_messages(event, context)
+    finally:
+        metrics.flush()
+
+
+def handle_messages(event, context):
+    messages = event['messages']
+    print('Received {} messages'.format(len(messages)))
+
+    # Messages of the same session stay in order, different sessions are sent to Lex concurrently
+    sessions = {}
+    replies = [timeout_reply] * len(messages)
+    for position, message in enumerate(messages):
+        session_id = get_session_id(event, message)
+        if session_id is None:
+            # A new Lex session on every turn would never get past the first question
+            replies[position] = unidentified_reply
+            metrics.increment('unidentified_messages')
+            continue
+        sessions.setdefault(session_id, []).append((position, message['unstructured']['text']))
+    if not sessions:
+        return {
+            'statusCode': 200,
+            'messages': [{'type': 'unstructured', 'unstructured': {'text': reply}} for reply in replies]
+        }
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sessions))))
+    futures = {executor.submit(converse, [(session_id, text) for _, text in turns]): turns
+               for session_id, turns in sessions.items()}
+    done, not_done = wait(futures, timeout=get_time_budget_seconds(context))
+    # Do not wait on calls that ran over the budget, their messages get the timeout reply.
+    # Sessions still queued are not sent at all, their users will say it again
+    executor.shutdown(wait=False, cancel_futures=True)
 
-    print(response)
+    for future in done:
+        turns = futures[future]
+        try:
+            for (position, _), reply in zip(turns, future.result()):
+                replies[position] = reply
+        except Exception as e:
+            logger.error('Error while sending {} messages to Lex'.format(len(turns)))
+            logger.error(e)
+            metrics.increment('lex_failures')
+            for position, _ in turns:
+                replies[position] = error_reply
+    if not_done:
+        metrics.increment('lex_timeouts', len(not_done))
+        logger.error('{} sessions ran over the time budget'.format(len(not_done)))
 
     return {
         'statusCode': 200,
-        'messages': [{'type': 'unstructured', 'unstructured': {'text': response['messages'][0]['content']}}]
+        'messages': [{'type': 'unstructured', 'unstructured': {'text': reply}} for reply in replies]
     }
@@ -2,29 +2,37 @@
 This Lambda Function demonstrates an implementation of the Lex Code Hook Interface
 in order to serve the Dining Concierge Chatbot which gives restaurant suggestions to the users.
 """
-import boto3
 import math
-import dateutil.parser
 import datetime
+import hashlib
 import time
 import re
 import os
 import json
+import uuid
 import logging
+from collections import namedtuple
+
+import clients
+import metrics
+import message_codec
+import locations
 
-sqs = boto3.client('sqs')
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
 """ --- Constants --- """
 dining_suggestions_intent = 'DiningSuggestionsIntent'
-default_location = 'Manhattan'
+example_locations = 'Manhattan, Brooklyn, Midtown or SoHo'
 default_cuisines = ['indian', 'chinese', 'japanese', 'italian', 'american']
 min_number_of_ppl = 2
 max_number_of_ppl = 20
 sqs_url = os.environ.get('SQS_URL')
 # Make a regular expression for validating an Email
 regex = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+email_pattern = re.compile(regex)
+# Session attribute holding the digests of the slot values that already passed validation
+validated_slots_attribute = 'validatedSlots'
 
 
 """ --- Helpers to build responses which match the structure of the necessary dialog actions --- """
@@ -106,124 +114,123 @@ def build_validation_result(is_valid, violated_slot, message_content):
     }
 
 
-def isvalid_date(date):
+@metrics.timed('sqs_enqueue')
+def send_to_sqs(values):
+    # Only the interpreted values are sent, in the compact format shared with lf2
+    # The fulfillment id lets lf2 recognise a redelivery of this request, and only of this one
+    response = clients.client('sqs').send_message(
+        QueueUrl=sqs_url,
+        MessageBody=message_codec.encode(values, uuid.uuid4().hex)
+    )
+    metrics.log_sampled('SQS Response', response)
+
+
+""" --- Slot validators, each returns None when the value is valid or the message to re-prompt with --- """
+
+
+def validate_location(location, values):
+    if locations.find_location(location) is None:
+        return 'I can find a restaurant for you in a New York City neighborhood, like {}. Can you please try again?'.format(example_locations)
+
+
+def validate_cuisine(cuisine, values):
+    if cuisine.lower() not in default_cuisines:
+        return 'Sorry, I can\'t find restaurants for {} cuisine. Could you try another one?'.format(cuisine)
+
+
+def validate_number_of_ppl(numberOfPpl, values):
+    numberOfPpl = parse_int(numberOfPpl)
+    if math.isnan(numberOfPpl) or numberOfPpl < min_number_of_ppl or numberOfPpl > max_number_of_ppl:
+        return 'I suggest to book for a minimum of {} & a maximum of {} people.'.format(min_number_of_ppl, max_number_of_ppl)
+
+
+def parse_date(date):
+    return datetime.datetime.strptime(date, '%Y-%m-%d').date()
+
+
+def validate_date(date, values):
     try:
-        dateutil.parser.parse(date)
-        return True
+        date_obj = parse_date(date)
     except ValueError:
-        return False
+        return 'I did not understand that, what date would you like to go to the restaurant?'
+    if date_obj < datetime.date.today():
+        return 'You can reserve your seats only in the future. What date would you like to go to the restaurant?'
 
 
-def send_to_sqs(slots):
-    response = sqs.send_message(
-        QueueUrl=sqs_url,
-        MessageBody=json.dumps(slots)
-    )
-    logger.info('SQS Response-> ')
-    logger.info(response)
-
-
-def validate_dining_suggestions(location, cuisine, numberOfPpl, date, time, phoneNumber, emailAddress):
-    numberOfPpl = parse_int(numberOfPpl) if numberOfPpl is not None else numberOfPpl
-
-    logger.info('Location captured-> {}, Default Location -> {}'.format(location, default_location))
-    if location is None:
-        logger.debug('Location is None')
-        return build_validation_result(False,
-                                       'location',
-                                       'Great. I can help you with that. What city or city area are you looking to dine in?')
-    elif location.lower() != default_location.lower():
-        logger.debug('Location {} is not valid.'.format(location))
-        return build_validation_result(False,
-                                       'location',
-                                       'I can find a restaurant for you in {}, Can you please try again?'.format(default_location))
-
-    logger.info('Cuisine captured-> {}, Default Cuisines -> {}'.format(cuisine, default_cuisines))
-    if cuisine is None:
-        logger.debug('Cuisine is None')
-        return build_validation_result(False,
-                                       'cuisine',
-                                       'Got it, {}. What cuisine would you like to try?'.format(default_location))
-    elif cuisine.lower() not in default_cuisines:
-        logger.debug('Invalid Cuisine-> {}'.format(cuisine))
-        return build_validation_result(False,
-                                       'cuisine',
-                                       'Sorry, I can\'t find restaurants for {} cuisine. Could you try another one?'.format(cuisine))
-
-    logger.info('Number of People captured-> {}, Max number of people -> {}'.format(numberOfPpl, max_number_of_ppl))
-    if numberOfPpl is None:
-        logger.debug('numberOfPpl is None')
-        return build_validation_result(False,
-                                       'numberOfPpl',
-                                       'Ok, how many people are in your party?')
-    elif numberOfPpl < min_number_of_ppl or numberOfPpl > max_number_of_ppl:
-        logger.debug('Invalid numberOfPpl-> {}'.format(numberOfPpl))
-        return build_validation_result(False,
-                                       'numberOfPpl',
-                                       'I suggest to book for a minimum of {} & a maximum of {} people.'.format(min_number_of_ppl, max_number_of_ppl))
-
-    logger.info('Date -> {}'.format(date))
-    date_obj = datetime.datetime.strptime(date, '%Y-%m-%d').date() if date is not None else None
-    if date is None:
-        logger.debug('Date is None')
-        return build_validation_result(False, 'date', 'A few more to go. What date?')
-    else:
-        if not isvalid_date(date):
-            logger.debug('Invalid Date-> {}'.format(date))
-            return build_validation_result(False, 'date', 'I did not understand that, what date would you like to go to the restaurant?')
-        elif date_obj < datetime.date.today():
-            logger.debug('Date is in the past-> {}'.format(date))
-            return build_validation_result(False, 'date', 'You can reserve your seats only in the future. What date would you like to go to the restaurant?')
-
-    logger.info('Time -> {}'.format(time))
-    if time is None:
-        logger.debug('Time is None')
-        return build_validation_result(False, 'time', 'What time?')
-    else:
-        if len(time) != 5:
-            logger.debug('Invalid Time-> {}'.format(time))
-            return build_validation_result(False, 'time', 'Invalid Time format -> {}. Can you try again?'.format(time))
-
-        hour, minute = time.split(':')
-        hour = parse_int(hour)
-        minute = parse_int(minute)
-        if math.isnan(hour) or math.isnan(minute):
-            logger.debug('Invalid Time-> {}'.format(time))
-            return build_validation_result(False, 'time', 'Invalid Time format -> {}. Can you try again?'.format(time))
-
+def validate_time(time, values):
+    if len(time) != 5:
+        return 'Invalid Time format -> {}. Can you try again?'.format(time)
+    try:
         time_obj = datetime.datetime.strptime(time, '%H:%M').time()
-        combined_datetime = datetime.datetime.combine(date_obj, time_obj)
-        if combined_datetime < datetime.datetime.now():
-            # Time is in the past
-            logger.debug('Time is in the past-> {}'.format(time))
-            return build_validation_result(False, 'time', 'You can reserve your seats only in the future. Can you specify a time in the future?')
-
-    logger.info('Phone Number -> {}'.format(phoneNumber))
-    if phoneNumber is None:
-        logger.debug('Phone Pumber is None')
-        return build_validation_result(False,
-                                       'phoneNumber',
-                                       'Could you help me with your phone number?')
-    elif len(phoneNumber) != 10:
-        logger.debug('Invalid Phone Pumber-> {}'.format(phoneNumber))
-        return build_validation_result(False,
-                                       'phoneNumber',
-                                       'Please enter a valid 10-digit phone number.')
-    
-    logger.info('Email Address -> {}'.format(emailAddress))
-    if emailAddress is None:
-        logger.debug('Email Address is None')
-        return build_validation_result(False,
-                                       'emailAddress',
-                                       'Great. Lastly, could you provide me with your email address so that I can send you my suggestions?')
-    elif (not re.fullmatch(regex, emailAddress)):
-        logger.debug('Invalid Email Address-> {}'.format(emailAddress))
-        return build_validation_result(False,
-                                       'emailAddress',
-                                       'Please enter a valid email address.')
-
-    logger.info('Validated all the slots\n')
-    return build_validation_result(True, None, None)
+    except ValueError:
+        return 'Invalid Time format -> {}. Can you try again?'.format(time)
+
+    # The date slot is validated before the time slot, so it parses here
+    combined_datetime = datetime.datetime.combine(parse_date(values['date']), time_obj)
+    if combined_datetime < datetime.datetime.now():
+        return 'You can reserve your seats only in the future. Can you specify a time in the future?'
+
+
+def validate_phone_number(phoneNumber, values):
+    if len(phoneNumber) != 10:
+        return 'Please enter a valid 10-digit phone number.'
+
+
+def validate_email_address(emailAddress, values):
+    if not email_pattern.fullmatch(emailAddress):
+        return 'Please enter a valid email address.'
+
+
+SlotValidator = namedtuple('SlotValidator', ['slot', 'missing_message', 'validate', 'depends_on', 'uses_clock'])
+
+# Slots are validated in this order, and the first violation is the slot that gets elicited.
+# A slot is validated again when its value, or the value of a slot it depends on, changes.
+# Slots checked against the current time are validated on every turn, a value in the future can become past.
+slot_validators = [
+    SlotValidator('location', 'Great. I can help you with that. What city or city area are you looking to dine in?', validate_location, (), False),
+    SlotValidator('cuisine', 'Got it. What cuisine would you like to try?', validate_cuisine, (), False),
+    SlotValidator('numberOfPpl', 'Ok, how many people are in your party?', validate_number_of_ppl, (), False),
+    SlotValidator('date', 'A few more to go. What date?', validate_date, (), True),
+    SlotValidator('time', 'What time?', validate_time, ('date',), True),
+    SlotValidator('phoneNumber', 'Could you help me with your phone number?', validate_phone_number, (), False),
+    SlotValidator('emailAddress', 'Great. Lastly, could you provide me with your email address so that I can send you my suggestions?', validate_email_address, (), False),
+]
+
+
+def slot_digest(validator, values):
+    text = '\x1f'.join([values[validator.slot]] + [values[slot] or '' for slot in validator.depends_on])
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=6).hexdigest()
+
+
+def load_validated_digests(session_attributes):
+    try:
+        return json.loads(session_attributes.get(validated_slots_attribute) or '{}')
+    except ValueError:
+        return {}
+
+
+def validate_dining_suggestions(values, validated_digests):
+    """
+    Validates the slot values in order, skipping the ones whose digest shows they were validated on an earlier turn,
+    unless they are checked against the current time.
+    Returns the validation result and the digests of every slot that is now known to be valid.
+    """
+    digests = {}
+    for validator in slot_validators:
+        value = values[validator.slot]
+        if value is None:
+            logger.debug('{} is None'.format(validator.slot))
+            return build_validation_result(False, validator.slot, validator.missing_message), digests
+
+        digest = slot_digest(validator, values)
+        if validator.uses_clock or validated_digests.get(validator.slot) != digest:
+            message = validator.validate(value, values)
+            if message is not None:
+                logger.debug('Invalid {}-> {}'.format(validator.slot, value))
+                return build_validation_result(False, validator.slot, message), digests
+        digests[validator.slot] = digest
+
+    return build_validation_result(True, None, None), digests
 
 
 """ --- Functions that control the bot's behavior --- """
@@ -237,41 +244,38 @@ def dining_suggestions(intent_request):
     """
 
     slots = get_slots(intent_request)
-    location = slots['location']['value']['interpretedValue'] if slots['location'] is not None else None
-    cuisine = slots['cuisine']['value']['interpretedValue'] if slots['cuisine'] is not None else None
-    numberOfPpl = slots['numberOfPpl']['value']['interpretedValue'] if slots['numberOfPpl'] is not None else None
-    date = slots['date']['value']['interpretedValue'] if slots['date'] is not None else None
-    time = slots['time']['value']['interpretedValue'] if slots['time'] is not None else None
-    phoneNumber = slots['phoneNumber']['value']['interpretedValue'] if slots['phoneNumber'] is not None else None
-    emailAddress = slots['emailAddress']['value']['interpretedValue'] if slots['emailAddress'] is not None else None
+    values = {validator.slot: slots[validator.slot]['value']['interpretedValue'] if slots.get(validator.slot) is not None else None
+              for validator in slot_validators}
     source = intent_request['invocationSource']
     intent_name = intent_request['sessionState']['intent']['name']
+    session_attributes = intent_request['sessionState'].get('sessionAttributes') or {}
 
     if source == 'DialogCodeHook':
         # Perform basic validation on the supplied input slots.
         # Use the elicitSlot dialog action to re-prompt for the first violation detected.
-        
-        validation_result = validate_dining_suggestions(location, cuisine, numberOfPpl, date, time, phoneNumber, emailAddress)
+        # Slots validated on earlier turns are skipped, their digests are kept in the session attributes.
+        with metrics.timer('validation'):
+            validation_result, digests = validate_dining_suggestions(values, load_validated_digests(session_attributes))
         logger.info('Validation Result -> {}'.format(validation_result['isValid']))
+        session_attributes[validated_slots_attribute] = json.dumps(digests, separators=(',', ':'))
         if not validation_result['isValid']:
             slots[validation_result['violatedSlot']] = None
-            return elicit_slot(intent_request['sessionState'].get('sessionAttributes'),
+            return elicit_slot(session_attributes,
                                 intent_name,
                                 slots,
                                 validation_result['violatedSlot'],
                                 validation_result.get('message'))
 
         # Pass data back through session attributes to be used in various prompts defined on the bot model.
-        output_session_attributes = intent_request['sessionState'].get('sessionAttributes') if intent_request['sessionState'].get('sessionAttributes') is not None else {}
-
-        return delegate(output_session_attributes, intent_name, get_slots(intent_request))
+        return delegate(session_attributes, intent_name, get_slots(intent_request))
 
     # Send the slot data to SQS queue
-    send_to_sqs(slots)
+    send_to_sqs(values)
 
-    # Send the closing response back to the user.
+    # Send the closing response back to the user, the next request starts its validation from scratch.
     logger.debug('Closing the intent as its fulfilled')
-    return close(intent_request['sessionState']['sessionAttributes'],
+    session_attributes.pop(validated_slots_attribute, None)
+    return close(session_attributes,
                 intent_name,
                 'Fulfilled',
                 {'contentType': 'PlainText',
@@ -310,9 +314,11 @@ def lambda_handler(event, context):
     os.environ['TZ'] = 'America/New_York'
     time.tzset()
     logger.info('event.bot.name={}'.format(event['bot']['name']))
-    logger.info(event)
+    metrics.log_sampled('Event', event)
 
-    result = dispatch(event)
-    logger.info('Result->\n\n')
-    logger.info(result)
+    try:
+        result = dispatch(event)
+    finally:
+        metrics.flush(InvocationSource=event.get('invocationSource', 'unknown'))
+    metrics.log_sampled('Result', result)
     return result
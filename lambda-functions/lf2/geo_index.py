@@ -0,0 +1,158 @@
+"""
+Nearest restaurant lookups over the catalog coordinates.
+
+Every cuisine gets its own KD-tree, built the first time the cuisine is asked for. Points are stored as 3D unit
+vectors, where the straight-line distance orders points the same way as the great-circle distance, so the tree
+works the same for a neighborhood as for points across cities.
+"""
+import re
+import math
+import heapq
+import threading
+
+""" --- Constants --- """
+earth_radius_km = 6371.0
+# The catalog stores coordinates as "{'latitude': 40.75, 'longitude': -73.98}"
+coordinates_pattern = re.compile(r"'latitude':\s*(-?[0-9.]+).*?'longitude':\s*(-?[0-9.]+)")
+
+
+def parse_coordinates(text):
+    """
+    Returns (latitude, longitude) from the coordinates column, or None.
+    """
+    match = coordinates_pattern.search(text or '')
+    if match is None:
+        return None
+    return float(match.group(1)), float(match.group(2))
+
+
+def unit_vector(latitude, longitude):
+    latitude = math.radians(latitude)
+    longitude = math.radians(longitude)
+    return (math.cos(latitude) * math.cos(longitude), math.cos(latitude) * math.sin(longitude), math.sin(latitude))
+
+
+def chord_to_km(squared_chord):
+    return 2 * earth_radius_km * math.asin(min(1.0, math.sqrt(squared_chord) / 2))
+
+
+class KDTree:
+    """
+    Static KD-tree kept as one list, the median of every range is the node splitting it.
+    Every node also keeps the bounding box of its range, which bounds the distance to anything below it.
+    """
+
+    def __init__(self, points):
+        # points are (latitude, longitude, value)
+        self.nodes = [(unit_vector(latitude, longitude), value) for latitude, longitude, value in points]
+        self.boxes = [None] * len(self.nodes)
+        ranges = []
+        stack = [(0, len(self.nodes), 0)]
+        while stack:
+            low, high, axis = stack.pop()
+            if low >= high:
+                continue
+            ranges.append((low, high))
+            self.nodes[low:high] = sorted(self.nodes[low:high], key=lambda node: node[0][axis])
+            middle = (low + high) // 2
+            stack.append((low, middle, (axis + 1) % 3))
+            stack.append((middle + 1, high, (axis + 1) % 3))
+
+        # Ranges are split after they are listed, so going backwards every child's box is ready before its parent's
+        for low, high in reversed(ranges):
+            middle = (low + high) // 2
+            point = self.nodes[middle][0]
+            lower, upper = list(point), list(point)
+            for child in ((low + middle) // 2 if low < middle else None, (middle + 1 + high) // 2 if middle + 1 < high else None):
+                if child is not None:
+                    child_lower, child_upper = self.boxes[child]
+                    for axis in range(3):
+                        lower[axis] = min(lower[axis], child_lower[axis])
+                        upper[axis] = max(upper[axis], child_upper[axis])
+            self.boxes[middle] = (lower, upper)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def nearest(self, latitude, longitude, k):
+        """
+        Returns up to k (distance in km, value) pairs, closest first.
+        """
+        if k <= 0 or not self.nodes:
+            return []
+        target = unit_vector(latitude, longitude)
+        # Max-heap of the k best so far, as (-squared distance, position)
+        best = []
+        stack = [(0, len(self.nodes), 0)]
+        while stack:
+            low, high, axis = stack.pop()
+            if low >= high:
+                continue
+            middle = (low + high) // 2
+            if len(best) == k:
+                # Skip the range when its bounding box is further than the k-th closest point so far
+                lower, upper = self.boxes[middle]
+                bound = 0.0
+                for coordinate, minimum, maximum in zip(target, lower, upper):
+                    if coordinate < minimum:
+                        bound += (minimum - coordinate) ** 2
+                    elif coordinate > maximum:
+                        bound += (coordinate - maximum) ** 2
+                if bound >= -best[0][0]:
+                    continue
+
+            point, _ = self.nodes[middle]
+            squared = (point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2 + (point[2] - target[2]) ** 2
+            if len(best) < k:
+                heapq.heappush(best, (-squared, middle))
+            elif squared < -best[0][0]:
+                heapq.heapreplace(best, (-squared, middle))
+
+            # The far side is pushed first so it is searched last, once the near side has tightened the k-th distance
+            next_axis = (axis + 1) % 3
+            if target[axis] < point[axis]:
+                stack.append((middle + 1, high, next_axis))
+                stack.append((low, middle, next_axis))
+            else:
+                stack.append((low, middle, next_axis))
+                stack.append((middle + 1, high, next_axis))
+
+        return [(chord_to_km(-squared), self.nodes[position][1]) for squared, position in sorted(best, reverse=True)]
+
+
+class GeoIndex:
+    """
+    KD-trees by cuisine, built lazily from `points_for_term(term)`, which returns (latitude, longitude, value) tuples.
+    """
+
+    def __init__(self, points_for_term):
+        self.points_for_term = points_for_term
+        self.trees = {}
+        self.lock = threading.Lock()
+
+    def tree(self, term):
+        key = term.strip().lower()
+        tree = self.trees.get(key)
+        if tree is None:
+            with self.lock:
+                tree = self.trees.get(key)
+                if tree is None:
+                    tree = self.trees[key] = KDTree(self.points_for_term(key))
+        return tree
+
+    def nearest(self, term, latitude, longitude, k):
+        return self.tree(term).nearest(latitude, longitude, k)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Index over a restaurant snapshot, the values are its record numbers.
+        """
+        def points_for_term(term):
+            points = []
+            for number in snapshot.record_numbers(term):
+                coordinates = snapshot.coordinates(number)
+                if coordinates is not None:
+                    points.append((coordinates[0], coordinates[1], number))
+            return points
+        return cls(points_for_term)
@@ -0,0 +1,161 @@
+"""
+Remembers the requests whose suggestions were already delivered, so a redelivered SQS message is acknowledged
+without searching or emailing again.
+
+A request is keyed on a hash of its fulfillment id and slot values. Before sending, a request is claimed with a
+conditional write that expires after a short lease, so two containers handling the same redelivery do not both
+send it. After sending, the record is marked fulfilled until the table's TTL on `expires_at` removes it, and the
+key is kept in an in-container LRU. Table errors fail open: the request is sent rather than dropped.
+"""
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import message_codec
+import resilience
+
+logger = logging.getLogger()
+
+""" --- Constants --- """
+max_batch_get_keys = 100
+max_write_workers = 10
+claimed = 'claimed'
+fulfilled = 'fulfilled'
+
+
+def request_key(request, message_id):
+    """
+    Stable key of a decoded request, the same for every delivery of the message.
+    lf1 gives every fulfillment its own id, messages without one fall back to the SQS message id,
+    which also stays the same across redeliveries.
+    """
+    values = [request.get('fulfillmentId') or message_id] + [request[field] for field in message_codec.message_fields]
+    return hashlib.blake2b(json.dumps(values, separators=(',', ':')).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def is_conditional_check_failure(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+class FulfilledRequests:
+    """
+    Claims and fulfilled request keys, in the DynamoDB table `table_name` when one is given.
+    Fulfilled keys are also kept in `cache`.
+    """
+
+    def __init__(self, dynamodb, table_name, ttl_seconds, claim_seconds, cache, timeout_seconds, clock=time.time):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.claim_seconds = claim_seconds
+        self.cache = cache
+        self.timeout_seconds = timeout_seconds
+        self.clock = clock
+
+    def _batch_get(self, keys):
+        found = set()
+        # status is a DynamoDB reserved word
+        request = {self.table_name: {'Keys': [{'id': key} for key in keys], 'ConsistentRead': True,
+                                     'ProjectionExpression': 'id, #s, expires_at',
+                                     'ExpressionAttributeNames': {'#s': 'status'}}}
+        response = self.dynamodb.batch_get_item(RequestItems=request)
+        now = self.clock()
+        for item in response.get('Responses', {}).get(self.table_name, []):
+            # TTL deletes expired records lazily, they can still be read for a while
+            if item.get('status') == fulfilled and int(item.get('expires_at', 0)) > now:
+                found.add(item['id'])
+        unprocessed = (response.get('UnprocessedKeys') or {}).get(self.table_name, {}).get('Keys', [])
+        if unprocessed:
+            logger.error('{} fulfilled request keys were not read'.format(len(unprocessed)))
+        return found
+
+    def fulfilled(self, keys):
+        """
+        Returns the keys that were already fulfilled.
+        """
+        unique_keys = list(dict.fromkeys(keys))
+        found = set(self.cache.get_many(unique_keys))
+        missing = [key for key in unique_keys if key not in found]
+        if not missing or self.table_name is None:
+            return found
+
+        for start in range(0, len(missing), max_batch_get_keys):
+            batch = missing[start:start + max_batch_get_keys]
+            try:
+                with metrics.timer('idempotency_lookup'):
+                    keys_found = resilience.call('idempotency', lambda: self._batch_get(batch), self.timeout_seconds, attempts=2)
+            except Exception as e:
+                logger.error('Error while looking up {} fulfilled requests-> {}'.format(len(batch), e))
+                continue
+            for key in keys_found:
+                self.cache.put(key, True)
+            found.update(keys_found)
+        return found
+
+    def _put(self, key, message_id, status, seconds, condition=None):
+        now = int(self.clock())
+        item = {'id': key, 'status': status, 'message_id': message_id, 'updated_at': now, 'expires_at': now + int(seconds)}
+        if condition is None:
+            self.dynamodb.Table(self.table_name).put_item(Item=item)
+        else:
+            self.dynamodb.Table(self.table_name).put_item(Item=item, ConditionExpression=condition)
+
+    def _put_claim(self, key, message_id):
+        from boto3.dynamodb.conditions import Attr
+        # Only a key nobody holds can be claimed, a live claim or a fulfilled record blocks it
+        condition = Attr('id').not_exists() | Attr('expires_at').lt(int(self.clock()))
+        try:
+            self._put(key, message_id, claimed, self.claim_seconds, condition)
+            return True
+        except Exception as e:
+            # A failed condition is an answer, not a failure of the table
+            if is_conditional_check_failure(e):
+                return False
+            raise
+
+    def _claim(self, key, message_id):
+        try:
+            with metrics.timer('idempotency_claim'):
+                return resilience.call('idempotency', lambda: self._put_claim(key, message_id), self.timeout_seconds)
+        except Exception as e:
+            logger.error('Error while claiming request {}, sending it anyway-> {}'.format(message_id, e))
+            return True
+
+    def claim(self, senders):
+        """
+        Claims the requests about to be sent, from a dict of request key to message id.
+        Returns the keys that were claimed, the others are being or were sent by another delivery.
+        """
+        senders = list(senders.items())
+        if not senders or self.table_name is None:
+            return set(key for key, _ in senders)
+        # Conditional writes cannot be batched, they are sent concurrently instead
+        with ThreadPoolExecutor(max_workers=min(max_write_workers, len(senders))) as executor:
+            results = list(executor.map(lambda sender: self._claim(*sender), senders))
+        keys = set(key for (key, _), ok in zip(senders, results) if ok)
+        metrics.increment('requests_claimed_elsewhere', len(senders) - len(keys))
+        return keys
+
+    def _record(self, key, message_id):
+        try:
+            with metrics.timer('idempotency_record'):
+                resilience.call('idempotency', lambda: self._put(key, message_id, fulfilled, self.ttl_seconds),
+                                self.timeout_seconds, attempts=2)
+        except Exception as e:
+            # The claim still holds the request off until its lease ends
+            logger.error('Error while recording fulfilled request {}-> {}'.format(message_id, e))
+
+    def record(self, fulfilled_requests):
+        """
+        Records the (key, message id) pairs of the requests that were just fulfilled.
+        """
+        fulfilled_requests = list(fulfilled_requests)
+        for key, _ in fulfilled_requests:
+            self.cache.put(key, True)
+        if not fulfilled_requests or self.table_name is None:
+            return
+        with ThreadPoolExecutor(max_workers=min(max_write_workers, len(fulfilled_requests))) as executor:
+            list(executor.map(lambda pair: self._record(*pair), fulfilled_requests))
@@ -1,22 +1,32 @@
-import boto3
-from boto3.dynamodb.conditions import Attr
-from requests_aws4auth import AWS4Auth
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-import requests
+from concurrent.futures import ThreadPoolExecutor
 import json
+import math
 import os
+import zlib
+import random
 import logging
 
-sqs = boto3.client('sqs')
-sns = boto3.client('sns')
-dynamodb = boto3.resource('dynamodb')
+import clients
+import metrics
+import message_codec
+import resilience
+import locations
+import idempotency
+from cache import TTLCache
+from notifications import NotificationDispatcher
+from restaurant_repository import RestaurantRepository
+from restaurant_snapshot import load_snapshot
+from geo_index import GeoIndex
+
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
 """ --- Constants --- """
 sqs_url = os.environ.get('SQS_URL')
 max_sqs_poll_msgs = 10
+max_wait_time_seconds = int(os.environ.get('SQS_WAIT_TIME_SECONDS', '20'))
+drain_safety_margin_millis = int(os.environ.get('DRAIN_SAFETY_MARGIN_MILLIS', '10000'))
+default_time_budget_millis = 60000
 elastic_search_host = os.environ.get('ELASTIC_SEARCH_HOST')
 elastic_search_region = os.environ.get('ELASTIC_SEARCH_REGION')
 elastic_search_index = os.environ.get('ELASTIC_SEARCH_INDEX')
@@ -24,51 +34,156 @@ dynamodb_table = os.environ.get('DYNAMODB_TABLE')
 from_email = os.environ.get('FROM_EMAIL')
 subject = 'Your restaurant suggestions are here!'
 sendgrid_api_key = os.environ.get('SENDGRID_API_KEY')
+sms_enabled = os.environ.get('SEND_SMS', 'false').lower() == 'true'
+max_suggestions = 3
+# Candidates fetched per cuisine, each message picks its suggestions from them
+search_candidates = int(os.environ.get('SEARCH_CANDIDATES', '30'))
+# Indexes loaded with --denormalised carry the display fields, older ones only the id
+search_fields = ['id', 'name', 'address', 'rating', 'review_count', 'zip_code']
+max_workers = int(os.environ.get('MAX_WORKERS', '10'))
+# Latency budgets of the downstream calls, a search still running after the hedge delay gets a second request
+es_timeout_seconds = int(os.environ.get('ES_TIMEOUT_MILLIS', '2000')) / 1000
+es_hedge_after_seconds = int(os.environ.get('ES_HEDGE_AFTER_MILLIS', '300')) / 1000
+dynamodb_timeout_seconds = int(os.environ.get('DYNAMODB_TIMEOUT_MILLIS', '2000')) / 1000
+cuisine_cache_size = int(os.environ.get('CUISINE_CACHE_SIZE', '64'))
+cuisine_cache_ttl_seconds = int(os.environ.get('CUISINE_CACHE_TTL_SECONDS', '300'))
+restaurant_cache_size = int(os.environ.get('RESTAURANT_CACHE_SIZE', '5000'))
+restaurant_cache_ttl_seconds = int(os.environ.get('RESTAURANT_CACHE_TTL_SECONDS', '3600'))
+snapshot_path = os.environ.get('SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'restaurants.snapshot'))
+snapshot_max_age_seconds = int(os.environ.get('SNAPSHOT_MAX_AGE_SECONDS', str(7 * 24 * 3600)))
+# Restaurants further than this from the requested location are not suggested as nearby
+max_distance_km = float(os.environ.get('MAX_DISTANCE_KM', '10'))
+# Candidates ranked per request, from the snapshot and around the location
+ranking_candidates = int(os.environ.get('RANKING_CANDIDATES', '500'))
+nearby_candidates = int(os.environ.get('NEARBY_CANDIDATES', '50'))
+# Random score offset of up to this much, seeded by the recipient, so users asking for the same thing get different picks
+ranking_exploration = float(os.environ.get('RANKING_EXPLORATION', '0.05'))
+# Table of the fulfilled requests, without one duplicates are only recognised within a container
+idempotency_table = os.environ.get('IDEMPOTENCY_TABLE')
+# SQS keeps a message for 4 days by default, it cannot be redelivered after that
+idempotency_ttl_seconds = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(4 * 24 * 3600)))
+# Lease of a claim taken before sending, a delivery that dies while sending holds the request off this long
+idempotency_claim_seconds = int(os.environ.get('IDEMPOTENCY_CLAIM_SECONDS', '120'))
+idempotency_timeout_seconds = int(os.environ.get('IDEMPOTENCY_TIMEOUT_MILLIS', '1000')) / 1000
+fulfilled_cache_size = int(os.environ.get('FULFILLED_CACHE_SIZE', '10000'))
 
+# Module level caches survive across invocations of a warm container
+cuisine_cache = TTLCache(cuisine_cache_size, cuisine_cache_ttl_seconds)
+restaurant_cache = TTLCache(restaurant_cache_size, restaurant_cache_ttl_seconds)
+fulfilled_cache = TTLCache(fulfilled_cache_size, idempotency_ttl_seconds)
+# Created on first use, like the AWS clients, so a drain of an empty queue never loads the DynamoDB resource
+restaurants = None
+fulfilled_requests = None
+# Mapped once at cold start, None when the snapshot is missing or stale and ES/DynamoDB are used instead
+snapshot = load_snapshot(snapshot_path, snapshot_max_age_seconds)
+# Nearest restaurant lookups over the snapshot, the tree of a cuisine is built on its first request
+geo_index = GeoIndex.from_snapshot(snapshot) if snapshot is not None else None
 
-def send_email(emails, message):
-    message = Mail(
-        from_email=from_email,
-        to_emails=emails,
-        subject=subject,
-        html_content=message)
-    try:
-        sg = SendGridAPIClient(sendgrid_api_key)
-        response = sg.send(message)
-        print(response.status_code)
-        print(response.body)
-    except Exception as e:
-        print(e.message)
 
+def restaurant_repository():
+    global restaurants
+    if restaurants is None:
+        restaurants = RestaurantRepository(clients.resource('dynamodb'), dynamodb_table, cache=restaurant_cache)
+    return restaurants
 
-def send_sms(msgToSend, phoneNumber):
-    response = sns.publish(
-        PhoneNumber='+1{}'.format(phoneNumber),
-        Message=msgToSend,
-        MessageStructure='string'
-    )
 
-    print('SNS Response-> {}'.format(response))
-    return response
+def fulfilled_request_store():
+    global fulfilled_requests
+    if fulfilled_requests is None:
+        dynamodb = clients.resource('dynamodb') if idempotency_table else None
+        fulfilled_requests = idempotency.FulfilledRequests(dynamodb, idempotency_table, idempotency_ttl_seconds,
+                                                           idempotency_claim_seconds, fulfilled_cache,
+                                                           idempotency_timeout_seconds)
+    return fulfilled_requests
 
 
-def delete_message_from_queue(receipt_handle):
-    try:
-        sqs.delete_message(QueueUrl=sqs_url, ReceiptHandle=receipt_handle)
-        print('Message with ReceiptHandle {} deleted'.format(receipt_handle))
-    except Exception as e:
-        logger.error('Error while deleting message with ReceiptHandle {}'.format(receipt_handle))
-        logger.error(e)
+def invalidate_caches():
+    cuisine_cache.invalidate()
+    restaurant_cache.invalidate()
+    print('Cuisine and restaurant caches invalidated')
+
+
+last_cache_stats = {}
+
+
+def record_cache_metrics():
+    # The cache counters are cumulative over the container, only what changed in this invocation is recorded
+    for name, cache in [('cuisine_cache', cuisine_cache), ('restaurant_cache', restaurant_cache), ('fulfilled_cache', fulfilled_cache)]:
+        stats = cache.stats()
+        previous = last_cache_stats.get(name, {'hits': 0, 'misses': 0})
+        metrics.increment('{}_hits'.format(name), stats['hits'] - previous['hits'])
+        metrics.increment('{}_misses'.format(name), stats['misses'] - previous['misses'])
+        last_cache_stats[name] = stats
+
+
+def delete_messages_from_queue(messages):
+    # SQS accepts at most 10 entries per DeleteMessageBatch call
+    for start in range(0, len(messages), max_sqs_poll_msgs):
+        entries = [{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                   for i, message in enumerate(messages[start:start + max_sqs_poll_msgs])]
+        try:
+            with metrics.timer('sqs_delete'):
+                response = clients.client('sqs').delete_message_batch(QueueUrl=sqs_url, Entries=entries)
+            print('Deleted {} messages'.format(len(response.get('Successful', []))))
+            for failure in response.get('Failed', []):
+                logger.error('Error while deleting message {}-> {}'.format(failure['Id'], failure.get('Message')))
+            metrics.increment('sqs_delete_failures', len(response.get('Failed', [])))
+        except Exception as e:
+            metrics.increment('sqs_delete_failures', len(entries))
+            logger.error('Error while deleting {} messages'.format(len(entries)))
+            logger.error(e)
 
 
-def fetch_from_queue():
-    sqs_response = sqs.receive_message(QueueUrl=sqs_url, MaxNumberOfMessages=max_sqs_poll_msgs)
+def fetch_from_queue(wait_time_seconds=0, visibility_timeout=None):
+    params = {
+        'QueueUrl': sqs_url,
+        'MaxNumberOfMessages': max_sqs_poll_msgs,
+        'WaitTimeSeconds': wait_time_seconds
+    }
+    if visibility_timeout is not None:
+        params['VisibilityTimeout'] = visibility_timeout
+    with metrics.timer('sqs_receive'):
+        sqs_response = clients.client('sqs').receive_message(**params)
     return sqs_response['Messages'] if 'Messages' in sqs_response.keys() else []
 
 
-def query_dynamo_db(ids, cuisine, location, numberOfPpl, date, time):
-    table = dynamodb.Table(dynamodb_table)
-    counter = 0
+def remaining_time_millis(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return default_time_budget_millis
+    return context.get_remaining_time_in_millis()
+
+
+def drain_queue(context):
+    """
+    Receives and processes batches until the queue is empty or the invocation is about to run out of time.
+    Every batch is delivered and acknowledged before the next receive, so no suggestion waits for the drain to end.
+    Returns the number of received messages and the failed messages.
+    """
+    received = 0
+    failed = []
+    while True:
+        remaining = remaining_time_millis(context) - drain_safety_margin_millis
+        if remaining <= 0:
+            print('Stopping drain, {} ms left'.format(remaining + drain_safety_margin_millis))
+            break
+
+        # Long poll only as long as the budget allows, and keep the batch hidden
+        # no longer than this invocation can work on it so a timeout hands it back quickly
+        wait_time_seconds = min(max_wait_time_seconds, remaining // 1000)
+        visibility_timeout = math.ceil((remaining + drain_safety_margin_millis) / 1000)
+        messages = fetch_from_queue(wait_time_seconds, visibility_timeout)
+        if not messages:
+            break
+
+        received += len(messages)
+        print('Received {} messages from SQS'.format(len(messages)))
+        _, batch_failed = process_messages(messages)
+        failed.extend(batch_failed)
+
+    return received, failed
+
+
+def suggestion_message(items, cuisine, location, numberOfPpl, date, time):
     messageToSend = 'Hello! Here are my {cuisine} restaurant suggestions in {location} for {numberOfPpl} people, for {date} at {time}: '.format(
                 cuisine=cuisine,
                 location=location,
@@ -77,81 +192,339 @@ def query_dynamo_db(ids, cuisine, location, numberOfPpl, date, time):
                 time=time,
             )
 
-    for id in ids:
-        if counter == 3:
-            break
-
-        response = table.scan(FilterExpression=Attr('id').eq(id))
-        item = response['Items'][0] if len(response['Items']) > 0 else None
-        if response is None or item is None:
-            continue
+    for counter, item in enumerate(items[:max_suggestions]):
         restaurantMsg = '' + str(counter) + '. '
         name = item['name']
         address = item['address']
         restaurantMsg += name +', located at ' + address +'. '
         messageToSend += restaurantMsg
-        counter += 1
 
     return messageToSend
 
 
-def query_elastic_search(cuisine):
-    credentials = boto3.Session().get_credentials()
-    awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, elastic_search_region, 'es', session_token=credentials.token)
+def query_dynamo_db(ids, emailAddress, cuisine, location, numberOfPpl, date, time):
+    # One keyed batch lookup for every candidate, then the best of them are suggested
+    with metrics.timer('dynamodb_lookup'):
+        items = resilience.call('dynamodb', lambda: restaurant_repository().get_many(ids), dynamodb_timeout_seconds, attempts=2)
+    return suggestion_message(rank_items(items, emailAddress), cuisine, location, numberOfPpl, date, time)
+
+
+def cuisine_query(cuisine, seed):
+    # Random but seeded scoring, so a cached candidate list is stable while different drains see different restaurants
+    return {
+        'size': search_candidates,
+        '_source': search_fields,
+        'query': {
+            'function_score': {
+                'query': {'term': {'categories': cuisine.lower()}},
+                'random_score': {'seed': seed, 'field': '_seq_no'},
+                'boost_mode': 'replace'
+            }
+        }
+    }
+
+
+@metrics.timed('es_query')
+def query_elastic_search(cuisines, seed=None):
+    """
+    Searches every cuisine with a single _msearch request.
+    Returns a dict from cuisine to the candidate documents.
+    A cuisine whose search failed is left out, so its messages fail and are retried, only one without hits is empty.
+    """
+    # Pooled keep-alive session, signed with credentials that are only refreshed when they change
+    session = clients.es_session(elastic_search_region)
+    seed = random.randrange(2 ** 31) if seed is None else seed
+
+    lines = []
+    for cuisine in cuisines:
+        lines.append(json.dumps({'index': elastic_search_index}))
+        lines.append(json.dumps(cuisine_query(cuisine, seed)))
+    es_query = '{}_msearch'.format(elastic_search_host)
 
-    es_query = '{}{}/_search?q={cuisine}'.format(elastic_search_host, elastic_search_index, cuisine=cuisine)
-    es_data = {}
+    body = '\n'.join(lines) + '\n'
 
-    es_response = requests.get(es_query, auth=awsauth)
+    def search():
+        response = session.post(es_query, data=body, headers={'Content-Type': 'application/x-ndjson'}, timeout=es_timeout_seconds)
+        response.raise_for_status()
+        return response
+
+    # Searches are reads, a slow one is hedged and a failed one retried
+    es_response = resilience.call('elasticsearch', search, es_timeout_seconds, attempts=2, hedge_after=es_hedge_after_seconds)
 
     data = json.loads(es_response.content.decode('utf-8'))
-    try:
-        es_data = data['hits']['hits']
-    except KeyError:
-        logger.debug('Error extracting hits from ES response')
-        
-    # extract bID from AWS ES
-    ids = []
-    for restaurant in es_data:
-        ids.append(restaurant['_source']['id'])
-      
-    return ids
+    responses = data.get('responses') or []
+    if len(responses) != len(cuisines):
+        logger.error('Expected {} search responses, got {}'.format(len(cuisines), len(responses)))
 
+    documents = {}
+    for cuisine, response in zip(cuisines, responses):
+        hits = response.get('hits', {}).get('hits') if 'error' not in response else None
+        if hits is None:
+            logger.error('Error extracting hits for {} from ES response-> {}'.format(cuisine, response.get('error')))
+            metrics.increment('search_failures')
+            continue
+        documents[cuisine] = [hit['_source'] for hit in hits]
+    return documents
 
-def lambda_handler(event, context):
-    print('Cloud Watch event-> {}'.format(event))
-    
-    messages = fetch_from_queue()
-    
-    print('Received {} messages from SQS'.format(len(messages)))
-    
+
+def search_restaurants(cuisines):
+    """
+    Returns a dict from cuisine to its candidate documents, searching the uncached cuisines together.
+    When the search fails the uncached cuisines are left out, the cached ones are still answered.
+    """
+    documents = {}
+    missing = []
+    for cuisine in sorted(set(cuisine.lower() for cuisine in cuisines)):
+        cached = cuisine_cache.get(cuisine)
+        if cached is None:
+            missing.append(cuisine)
+        else:
+            documents[cuisine] = cached
+    if missing:
+        try:
+            found = query_elastic_search(missing)
+        except Exception as e:
+            logger.error('Error while searching {} cuisines-> {}'.format(len(missing), e))
+            metrics.increment('search_failures')
+            return documents
+        metrics.increment('es_cuisines_searched', len(missing))
+        for cuisine, cuisine_documents in found.items():
+            # A cuisine without hits is not cached, the index may still be loading
+            if cuisine_documents:
+                cuisine_cache.put(cuisine, cuisine_documents)
+            documents[cuisine] = cuisine_documents
+    return documents
+
+
+def rank_suggestions(ratings, review_counts, emailAddress, distances_km=None, groups=None):
+    """
+    Positions of the candidates to suggest, best first.
+    """
+    # Loads NumPy on the first message, not at cold start
+    import ranking
+    with metrics.timer('ranking'):
+        noise = ranking.user_noise(zlib.crc32(emailAddress.lower().encode('utf-8')), len(ratings), ranking_exploration)
+        if distances_km is not None:
+            distances_km = ranking.to_array(distances_km)
+        return ranking.rank(ranking.to_array(ratings), ranking.to_array(review_counts), max_suggestions, distances_km, groups, noise)
+
+
+def rank_items(items, emailAddress):
+    positions = rank_suggestions([item.get('rating') for item in items], [item.get('review_count') for item in items],
+                                 emailAddress, groups=[item.get('zip_code') for item in items])
+    return [items[position] for position in positions]
+
+
+def snapshot_covers(cuisine):
+    return snapshot is not None and bool(snapshot.record_numbers(cuisine, 1))
+
+
+def snapshot_suggestions(cuisine, location, emailAddress):
+    """
+    The best rated restaurants of the cuisine close to the location, or in the whole catalog when the location is unknown.
+    """
+    if snapshot is None:
+        return []
+    with metrics.timer('snapshot_lookup'):
+        place = locations.find_location(location)
+        if place is not None and geo_index is not None:
+            latitude, longitude = place[1]
+            nearest = [(distance, number) for distance, number in geo_index.nearest(cuisine, latitude, longitude, nearby_candidates)
+                       if distance <= max_distance_km]
+            if nearest:
+                numbers = [number for _, number in nearest]
+                stats = [snapshot.stats(number) for number in numbers]
+                positions = rank_suggestions([rating for rating, _ in stats], [count for _, count in stats], emailAddress,
+                                             distances_km=[distance for distance, _ in nearest])
+                return [snapshot.record(numbers[position]) for position in positions]
+
+        numbers = snapshot.record_numbers(cuisine, ranking_candidates)
+        stats = [snapshot.stats(number) for number in numbers]
+        positions = rank_suggestions([rating for rating, _ in stats], [count for _, count in stats], emailAddress)
+        return [snapshot.record(numbers[position]) for position in positions]
+
+
+@metrics.timed('message')
+def process_message(request, candidates):
+    metrics.log_sampled('Message Body', request)
+
+    cuisine = request['cuisine']
+    location = request['location']
+    numberOfPpl = request['numberOfPpl']
+    date = request['date']
+    time = request['time']
+    phoneNumber = request['phoneNumber']
+    emailAddress = request['emailAddress']
+
+    items = snapshot_suggestions(cuisine, location, emailAddress)
+    if items:
+        final_message = suggestion_message(items, cuisine, location, numberOfPpl, date, time)
+    else:
+        if cuisine.lower() not in candidates:
+            raise LookupError('No search results for {}'.format(cuisine))
+        documents = candidates[cuisine.lower()]
+        if documents and all(document.get('name') and document.get('address') for document in documents):
+            # Denormalised hits answer on their own, DynamoDB is only needed for id-only documents
+            metrics.increment('single_hop_messages')
+            final_message = suggestion_message(rank_items(documents, emailAddress), cuisine, location, numberOfPpl, date, time)
+        else:
+            final_message = query_dynamo_db([document['id'] for document in documents], emailAddress, cuisine, location, numberOfPpl, date, time)
+    metrics.log_sampled('Suggestion', final_message)
+
+    return emailAddress, phoneNumber, final_message
+
+
+def prepare_suggestions(messages):
+    """
+    Builds the suggestion for every message on a bounded worker pool.
+    The cuisines the snapshot cannot answer are searched up front, all in one request.
+    A failing message does not affect the others, it is left on the queue to be redelivered.
+    Requests that were already fulfilled are not prepared again, their notification is None.
+    Returns the (message, request key, notification) tuples that were prepared and the failed messages.
+    """
+    if not messages:
+        return [], []
+
+    prepared = []
+    failed = []
+    decoded = []
     for message in messages:
-        body = json.loads(message['Body'])
-        print('Message Body-> {}'.format(body))
-        
-        cuisine = body['cuisine']['value']['interpretedValue']
-        location = body['location']['value']['interpretedValue']
-        numberOfPpl = body['numberOfPpl']['value']['interpretedValue']
-        date = body['date']['value']['interpretedValue']
-        time = body['time']['value']['interpretedValue']
-        phoneNumber = body['phoneNumber']['value']['interpretedValue']
-        emailAddress = body['emailAddress']['value']['interpretedValue']
-        
-        ids = query_elastic_search(cuisine)
-        print(ids)
-
-        final_message = query_dynamo_db(ids, cuisine, location, numberOfPpl, date, time)
-        print(final_message)
-
-        # send final_message to phoneNumber using SNS
-        # send_sms(final_message, phoneNumber)
-
-        send_email(emailAddress, final_message)
-
-        receipt_handle = message['ReceiptHandle']
-        delete_message_from_queue(receipt_handle)
+        try:
+            # Accepts both the compact format and the full Lex slots sent by older versions of lf1
+            decoded.append((message, message_codec.decode(message['Body'])))
+        except message_codec.MessageFormatError as e:
+            logger.error('Error while decoding message {}-> {}'.format(message['MessageId'], e))
+            metrics.increment('message_failures')
+            failed.append(message)
+    if not decoded:
+        return prepared, failed
+
+    # A redelivered request that was already fulfilled is only acknowledged, before any search or email
+    keys = [idempotency.request_key(request, message['MessageId']) for message, request in decoded]
+    fulfilled = fulfilled_request_store().fulfilled(keys)
+    if fulfilled:
+        pending = []
+        for (message, request), key in zip(decoded, keys):
+            if key in fulfilled:
+                prepared.append((message, key, None))
+            else:
+                pending.append((message, request))
+        metrics.increment('fulfilled_messages_skipped', len(decoded) - len(pending))
+        keys = [key for key in keys if key not in fulfilled]
+        decoded = pending
+        if not decoded:
+            return prepared, failed
+
+    # Messages whose cuisine could not be searched fail on their own, the others go ahead
+    cuisines = set(request['cuisine'] for _, request in decoded)
+    candidates = search_restaurants(cuisine for cuisine in cuisines if not snapshot_covers(cuisine))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(decoded))) as executor:
+        futures = [executor.submit(process_message, request, candidates) for _, request in decoded]
+        for (message, _), key, future in zip(decoded, keys, futures):
+            try:
+                prepared.append((message, key, future.result()))
+            except Exception as e:
+                logger.error('Error while processing message {}'.format(message['MessageId']))
+                logger.exception(e)
+                metrics.increment('message_failures')
+                failed.append(message)
+
+    return prepared, failed
+
+
+def deliver_suggestions(prepared):
+    """
+    Sends the prepared suggestions through one dispatcher, so each recipient gets a single digest.
+    A request is sent once however many of its messages were prepared, and every one of them shares its outcome.
+    Returns the delivered and the undelivered messages.
+    """
+    if not prepared:
+        return [], []
+
+    # The message each request key is sent with, already fulfilled requests are not sent
+    senders = {}
+    for message, key, notification in prepared:
+        if notification is not None and key not in senders:
+            senders[key] = message['MessageId']
+    # A request claimed by another delivery is left on the queue, by the time it comes back it is fulfilled
+    # or the other claim has expired
+    claimed = fulfilled_request_store().claim(senders) if senders else set()
+    senders = {key: message_id for key, message_id in senders.items() if key in claimed}
+    delivered = {}
+    if senders:
+        sns = clients.client('sns') if sms_enabled else None
+        dispatcher = NotificationDispatcher(clients.sendgrid_client(sendgrid_api_key), sns, from_email, subject, sms_enabled)
+        added = set()
+        for message, key, notification in prepared:
+            if notification is not None and key in senders and key not in added:
+                added.add(key)
+                emailAddress, phoneNumber, final_message = notification
+                dispatcher.add(senders[key], emailAddress, phoneNumber, final_message)
+        with metrics.timer('notification_send'):
+            delivered = dispatcher.flush()
+        # Recorded before the messages are deleted, so a crash in between does not send them again
+        fulfilled_request_store().record((key, message_id) for key, message_id in senders.items() if delivered.get(message_id))
+
+    succeeded = [message for message, key, notification in prepared if notification is None or delivered.get(senders.get(key))]
+    undelivered = [message for message, key, notification in prepared if notification is not None and not delivered.get(senders.get(key))]
+    metrics.increment('undelivered_messages', len(undelivered))
+    return succeeded, undelivered
+
+
+def process_messages(messages, delete=True):
+    """
+    Prepares and delivers the suggestions for one batch of messages.
+    The successful messages are deleted from the queue unless delete is False.
+    Returns the successful and the failed messages.
+    """
+    prepared, failed = prepare_suggestions(messages)
+    succeeded, undelivered = deliver_suggestions(prepared)
+
+    if delete:
+        delete_messages_from_queue(succeeded)
+    return succeeded, failed + undelivered
+
+
+def lambda_handler(event, context):
+    metrics.log_sampled('Cloud Watch event', event)
+    resilience.set_deadline(context)
+
+    # The loaders can trigger the function with {"invalidateCache": true} after a catalog refresh
+    if event.get('invalidateCache'):
+        invalidate_caches()
+
+    try:
+        received, failed = drain_queue(context)
+        metrics.increment('messages_received', received)
+    finally:
+        record_cache_metrics()
+        metrics.flush(Handler='drain')
 
     return {
         'statusCode': 200,
-        'body': 'Received {} messages from SQS'.format(len(messages))
-    }
\ No newline at end of file
+        'body': 'Processed {} of {} messages from SQS'.format(received - len(failed), received),
+        'batchItemFailures': [{'itemIdentifier': message['MessageId']} for message in failed]
+    }
+
+
+def sqs_event_handler(event, context):
+    """
+    Entry point for an SQS event source mapping with ReportBatchItemFailures enabled.
+    Lambda deletes the successful records itself, only the failures are reported back.
+    """
+    messages = [{'MessageId': record['messageId'], 'ReceiptHandle': record['receiptHandle'], 'Body': record['body']}
+                for record in event['Records']]
+    print('Received {} records from the SQS event source'.format(len(messages)))
+    resilience.set_deadline(context)
+
+    try:
+        succeeded, failed = process_messages(messages, delete=False)
+        metrics.increment('messages_received', len(messages))
+    finally:
+        record_cache_metrics()
+        metrics.flush(Handler='sqs_event')
+
+    return {
+        'batchItemFailures': [{'itemIdentifier': message['MessageId']} for message in failed]
+    }
@@ -0,0 +1,146 @@
+"""
+Collects the suggestions produced for one batch of messages and delivers them together.
+Emails go out as SendGrid personalizations of a single request, and every recipient gets one digest
+no matter how many of their requests were in the batch. When SendGrid rejects a request, it is split
+until the recipients it rejects are found, so they do not hold back everyone else's email.
+"""
+import os
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import resilience
+
+logger = logging.getLogger()
+
+""" --- Constants --- """
+# SendGrid accepts at most 1000 personalizations per request
+max_personalizations = 1000
+max_sms_workers = 5
+suggestions_tag = '-suggestions-'
+email_separator = '<br><br>'
+sms_separator = '\n\n'
+# Rejections that every part of the request would get as well, splitting it does not help
+unsplittable_statuses = {401, 403, 429}
+# Sends are not retried. A send that timed out may still have been delivered, it is counted as delivered
+# so its recipients do not get the email twice
+sendgrid_timeout_seconds = int(os.environ.get('SENDGRID_TIMEOUT_MILLIS', '5000')) / 1000
+sns_timeout_seconds = int(os.environ.get('SNS_TIMEOUT_MILLIS', '3000')) / 1000
+
+
+def is_rejection(error):
+    """
+    Whether SendGrid answered and refused the request itself, rather than failing to answer.
+    """
+    status_code = getattr(error, 'status_code', None)
+    return status_code is not None and 400 <= status_code < 500 and status_code != 429
+
+
+class NotificationDispatcher:
+
+    def __init__(self, sendgrid_client, sns_client, from_email, subject, sms_enabled=False):
+        self.sendgrid_client = sendgrid_client
+        self.sns_client = sns_client
+        self.from_email = from_email
+        self.subject = subject
+        self.sms_enabled = sms_enabled
+        self.emails = OrderedDict()
+        self.sms = OrderedDict()
+
+    def add(self, message_id, email_address, phone_number, text):
+        self.emails.setdefault(email_address.lower(), []).append((message_id, text))
+        if self.sms_enabled and phone_number:
+            self.sms.setdefault(phone_number, []).append((message_id, text))
+
+    def _send_emails(self, recipients):
+        # Imported on the first send, the sendgrid helpers are heavy for a cold start that may have nothing to send
+        from sendgrid.helpers.mail import Mail, Personalization, To, Substitution
+        mail = Mail(from_email=self.from_email, subject=self.subject, html_content=suggestions_tag)
+        for email_address, suggestions in recipients:
+            personalization = Personalization()
+            personalization.add_to(To(email_address))
+            personalization.add_substitution(Substitution(suggestions_tag, email_separator.join(text for _, text in suggestions)))
+            mail.add_personalization(personalization)
+
+        def send():
+            try:
+                return self.sendgrid_client.send(mail), None
+            except Exception as e:
+                # A rejected request is an answer, SendGrid is up and its circuit stays closed
+                if is_rejection(e):
+                    return None, e
+                raise
+
+        with metrics.timer('sendgrid_send'):
+            response, rejection = resilience.call('sendgrid', send, sendgrid_timeout_seconds)
+        if rejection is not None:
+            raise rejection
+        print('SendGrid Response-> {} for {} recipients'.format(response.status_code, len(recipients)))
+
+    def _send_sms(self, phone_number, suggestions):
+        # PublishBatch only publishes to topics, direct SMS still takes one Publish per phone number
+        with metrics.timer('sns_publish'):
+            response = resilience.call('sns', lambda: self.sns_client.publish(
+                PhoneNumber='+1{}'.format(phone_number),
+                Message=sms_separator.join(text for _, text in suggestions),
+                MessageStructure='string'
+            ), sns_timeout_seconds)
+        metrics.log_sampled('SNS Response', response)
+
+    def _deliver_emails(self, recipients, delivered):
+        try:
+            self._send_emails(recipients)
+            ok = True
+        except resilience.CallAbandoned as e:
+            metrics.increment('sendgrid_unknown_outcomes')
+            logger.error('Sending emails to {} recipients timed out, counting them as delivered-> {}'.format(len(recipients), e))
+            ok = True
+        except Exception as e:
+            status_code = getattr(e, 'status_code', None)
+            if len(recipients) > 1 and is_rejection(e) and status_code not in unsplittable_statuses:
+                # A bad address rejects the whole request, halving finds it in a few requests
+                middle = len(recipients) // 2
+                logger.error('SendGrid rejected {} recipients with {}, splitting the request'.format(len(recipients), status_code))
+                metrics.increment('sendgrid_splits')
+                self._deliver_emails(recipients[:middle], delivered)
+                self._deliver_emails(recipients[middle:], delivered)
+                return
+            metrics.increment('sendgrid_failures')
+            logger.error('Error while sending emails to {} recipients'.format(len(recipients)))
+            logger.error(e)
+            ok = False
+        for _, suggestions in recipients:
+            for message_id, _ in suggestions:
+                delivered[message_id] = ok
+
+    def flush(self):
+        """
+        Sends everything collected so far.
+        Returns a dict from source message id to whether all of its notifications were delivered.
+        """
+        delivered = {}
+        recipients = list(self.emails.items())
+        for start in range(0, len(recipients), max_personalizations):
+            self._deliver_emails(recipients[start:start + max_personalizations], delivered)
+
+        if self.sms:
+            with ThreadPoolExecutor(max_workers=min(max_sms_workers, len(self.sms))) as executor:
+                futures = [(suggestions, executor.submit(self._send_sms, phone_number, suggestions))
+                           for phone_number, suggestions in self.sms.items()]
+                for suggestions, future in futures:
+                    try:
+                        future.result()
+                    except resilience.CallAbandoned as e:
+                        metrics.increment('sns_unknown_outcomes')
+                        logger.error('Sending SMS timed out, counting it as delivered-> {}'.format(e))
+                    except Exception as e:
+                        metrics.increment('sns_failures')
+                        logger.error('Error while sending SMS')
+                        logger.error(e)
+                        for message_id, _ in suggestions:
+                            delivered[message_id] = False
+
+        self.emails.clear()
+        self.sms.clear()
+        return delivered
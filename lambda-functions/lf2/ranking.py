@@ -0,0 +1,117 @@
+"""
+Scores candidate restaurants and picks the best k.
+
+The score of a candidate is its Bayesian rating (the rating pulled towards the mean of the candidates, less so the more
+reviews it has), plus a bonus for review volume, minus a penalty for distance when distances are known.
+The top of the list is found with a partial sort, and the final picks are spread over different groups (zip codes)
+by penalising a candidate for every pick already made from its group.
+"""
+import math
+
+import numpy as np
+
+""" --- Constants --- """
+max_rating = 5.0
+default_prior_rating = 3.5
+# Reviews a rating needs before it counts as much as the prior
+prior_weight = 25.0
+rating_weight = 1.0
+volume_weight = 0.2
+distance_weight = 0.5
+# Distance at which half of the distance penalty applies
+distance_scale_km = 1.0
+diversity_penalty = 0.1
+# Candidates considered for the diversity pass, per pick
+shortlist_factor = 4
+
+
+def to_array(values):
+    """
+    Floats from the stored values, NaN where a value is missing or not a number.
+    """
+    array = np.empty(len(values), dtype=np.float64)
+    for i, value in enumerate(values):
+        try:
+            array[i] = float(value)
+        except (TypeError, ValueError):
+            array[i] = math.nan
+    return array
+
+
+def bayesian_rating(ratings, review_counts, prior=None):
+    known = ~np.isnan(ratings)
+    if prior is None:
+        prior = float(ratings[known].mean()) if known.any() else default_prior_rating
+    # fmax turns the unknown counts into 0, and an unknown rating counts as no reviews
+    counts = np.where(known, np.fmax(review_counts, 0.0), 0.0)
+    weighted = np.where(known, ratings, prior)
+    weighted *= counts
+    weighted += prior_weight * prior
+    weighted /= counts + prior_weight
+    return weighted
+
+
+def scores(ratings, review_counts, distances_km=None, noise=None):
+    """
+    Score of every candidate. ratings, review_counts and distances_km are float arrays, NaN where unknown.
+    noise, when given, is added as is, to vary the picks between users.
+    """
+    result = bayesian_rating(ratings, review_counts)
+    result *= rating_weight / max_rating
+    counts = np.fmax(review_counts, 0.0)
+    largest = counts.max() if len(counts) else 0.0
+    if largest > 0:
+        volume = np.log1p(counts)
+        volume *= volume_weight / math.log1p(largest)
+        result += volume
+    if distances_km is not None:
+        # Unknown distances are not penalised
+        distances = np.fmax(distances_km, 0.0)
+        penalty = distances + distance_scale_km
+        np.divide(distances, penalty, out=penalty)
+        penalty *= distance_weight
+        result -= penalty
+    if noise is not None:
+        result += noise
+    return result
+
+
+def top_k(values, k):
+    """
+    Positions of the k largest values, largest first, without sorting the rest.
+    """
+    if k <= 0 or len(values) == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(values):
+        positions = np.argpartition(-values, k - 1)[:k]
+    else:
+        positions = np.arange(len(values))
+    return positions[np.argsort(-values[positions], kind='stable')]
+
+
+def rank(ratings, review_counts, k, distances_km=None, groups=None, noise=None):
+    """
+    Positions of the k candidates to suggest, best first.
+    groups, when given, is a list with a key per candidate, picks from a group that was already picked are penalised.
+    """
+    candidate_scores = scores(ratings, review_counts, distances_km, noise)
+    if groups is None:
+        return [int(position) for position in top_k(candidate_scores, k)]
+
+    shortlist = [int(position) for position in top_k(candidate_scores, k * shortlist_factor)]
+    picked = []
+    picks_by_group = {}
+    while shortlist and len(picked) < k:
+        best = max(shortlist, key=lambda position: candidate_scores[position] - diversity_penalty * picks_by_group.get(groups[position], 0))
+        shortlist.remove(best)
+        picked.append(best)
+        if groups[best]:
+            picks_by_group[groups[best]] = picks_by_group.get(groups[best], 0) + 1
+    return picked
+
+
+def user_noise(seed, size, scale):
+    """
+    Small random score offsets, the same for every request with the same seed.
+    """
+    return np.random.default_rng(seed).uniform(0.0, scale, size)
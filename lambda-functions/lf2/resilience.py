@@ -0,0 +1,183 @@
+"""
+Latency budgets for the calls lf2 makes to other services.
+
+Every call runs on a shared pool and is waited on for at most its timeout, capped by the time left in the invocation.
+A call that runs over is abandoned rather than waited for. Failed calls are retried with jittered backoff while the
+budget allows, idempotent reads can be hedged with a second request, and a circuit breaker per dependency fails calls
+fast while the dependency keeps failing.
+
+    resilience.set_deadline(context)
+    response = resilience.call('elasticsearch', lambda: session.post(url, data=body, timeout=2), timeout=2, attempts=2, hedge_after=0.3)
+"""
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import metrics
+
+logger = logging.getLogger()
+
+""" --- Constants --- """
+max_workers = int(os.environ.get('RESILIENCE_WORKERS', '32'))
+failure_threshold = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+reset_seconds = float(os.environ.get('BREAKER_RESET_SECONDS', '30'))
+# Calls must finish this long before the invocation times out
+safety_margin_millis = int(os.environ.get('CALL_SAFETY_MARGIN_MILLIS', '1000'))
+base_backoff_seconds = 0.05
+
+_executor = ThreadPoolExecutor(max_workers=max_workers)
+_breakers = {}
+_lock = threading.Lock()
+_deadline = None
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CallAbandoned(DeadlineExceeded):
+    """
+    The call was made but did not answer in time, it may still have succeeded.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures. While open, calls fail without being made.
+    After reset_seconds one trial call is let through, its result closes or reopens the circuit.
+    """
+
+    def __init__(self, name, failure_threshold=failure_threshold, reset_seconds=reset_seconds, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.clock() - self.opened_at >= self.reset_seconds else 'open'
+
+    def before_call(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return
+        metrics.increment('{}_short_circuits'.format(self.name))
+        raise CircuitOpenError('{} circuit is open'.format(self.name))
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error('Opening the {} circuit after {} failures'.format(self.name, self.failures))
+                self.opened_at = self.clock()
+            self.trial_running = False
+
+
+def breaker(name):
+    with _lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def reset():
+    """
+    Closes every circuit and clears the deadline.
+    """
+    global _deadline
+    with _lock:
+        _breakers.clear()
+    _deadline = None
+
+
+def set_deadline(context):
+    """
+    Starts the budget of an invocation from the Lambda context. Without a context calls are only bounded by their timeouts.
+    """
+    global _deadline
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        _deadline = None
+    else:
+        _deadline = time.monotonic() + (context.get_remaining_time_in_millis() - safety_margin_millis) / 1000
+
+
+def remaining_seconds():
+    return float('inf') if _deadline is None else _deadline - time.monotonic()
+
+
+def _run(name, fn, timeout, hedge_after):
+    end = time.monotonic() + timeout
+    futures = [_executor.submit(fn)]
+    if hedge_after is not None and hedge_after < timeout:
+        done, _ = wait(futures, timeout=hedge_after)
+        if not done:
+            metrics.increment('{}_hedges'.format(name))
+            futures.append(_executor.submit(fn))
+
+    error = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=max(0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    if error is not None and not pending:
+        raise error
+    # Calls still running are left to finish in the background, their results are dropped
+    raise CallAbandoned('{} call ran over {:.3f}s'.format(name, timeout))
+
+
+def call(name, fn, timeout, attempts=1, hedge_after=None):
+    """
+    Calls fn() for the dependency `name` within timeout seconds, capped by the invocation deadline.
+    Retries up to attempts times in total with full jitter backoff, and when hedge_after is set sends a second
+    request if the first has not answered after hedge_after seconds. Only pass attempts or hedge_after for idempotent calls.
+    """
+    circuit = breaker(name)
+    for attempt in range(attempts):
+        budget = min(timeout, remaining_seconds())
+        if budget <= 0:
+            raise DeadlineExceeded('No time left for the {} call'.format(name))
+        circuit.before_call()
+        try:
+            result = _run(name, fn, budget, hedge_after)
+        except Exception as e:
+            circuit.record_failure()
+            # Named apart from the failures the callers count themselves
+            metrics.increment('{}_call_failures'.format(name))
+            backoff = random.uniform(0, base_backoff_seconds * (2 ** attempt))
+            if attempt == attempts - 1 or backoff >= remaining_seconds():
+                raise
+            logger.error('{} call failed, retrying-> {}'.format(name, e))
+            metrics.increment('{}_call_retries'.format(name))
+            time.sleep(backoff)
+            continue
+        circuit.record_success()
+        return result
@@ -0,0 +1,70 @@
+"""
+Keyed access to the restaurants table.
+All candidate ids for a suggestion are fetched in a single BatchGetItem round trip instead of one scan per id.
+"""
+import random
+import time
+import logging
+
+import metrics
+
+logger = logging.getLogger()
+
+""" --- Constants --- """
+max_batch_get_keys = 100
+max_unprocessed_retries = 5
+base_backoff_seconds = 0.05
+restaurant_attributes = ['id', 'name', 'address', 'rating', 'review_count', 'zip_code']
+
+
+class RestaurantRepository:
+
+    def __init__(self, dynamodb, table_name, attributes=None, cache=None):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.attributes = attributes or restaurant_attributes
+        self.cache = cache
+
+    def _projection(self):
+        # Attribute names are aliased because `name` is a DynamoDB reserved word
+        names = {'#a{}'.format(i): attribute for i, attribute in enumerate(self.attributes)}
+        return {
+            'ProjectionExpression': ', '.join(names.keys()),
+            'ExpressionAttributeNames': names
+        }
+
+    def _batch_get(self, keys):
+        items = []
+        request = {self.table_name: dict(self._projection(), Keys=keys)}
+        attempt = 0
+        while request:
+            response = self.dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response.get('Responses', {}).get(self.table_name, []))
+            request = response.get('UnprocessedKeys') or {}
+            if not request:
+                break
+            if attempt == max_unprocessed_retries:
+                logger.error('Giving up on {} unprocessed keys'.format(len(request[self.table_name]['Keys'])))
+                break
+            # Unprocessed keys mean the table is throttling us, back off with full jitter before retrying
+            metrics.increment('dynamodb_retries')
+            time.sleep(random.uniform(0, base_backoff_seconds * (2 ** attempt)))
+            attempt += 1
+        return items
+
+    def get_many(self, ids):
+        """
+        Returns the restaurants for the given ids, in the order of the ids.
+        Ids that are not in the table are skipped. Only ids missing from the cache are read from the table.
+        """
+        unique_ids = list(dict.fromkeys(ids))
+        found = self.cache.get_many(unique_ids) if self.cache is not None else {}
+        missing = [id for id in unique_ids if id not in found]
+        for start in range(0, len(missing), max_batch_get_keys):
+            keys = [{'id': id} for id in missing[start:start + max_batch_get_keys]]
+            for item in self._batch_get(keys):
+                found[item['id']] = item
+                if self.cache is not None:
+                    self.cache.put(item['id'], item)
+
+        return [found[id] for id in unique_ids if id in found]
@@ -0,0 +1,250 @@
+"""
+Compact binary snapshot of the restaurant catalog, memory-mapped by lf2 so suggestions need no network calls.
+
+Build it from the CSV before packaging the function:
+
+    python lf2/restaurant_snapshot.py Restaurants.csv lf2/restaurants.snapshot
+
+Layout, all integers little-endian:
+    header      magic, version, build time, record/term counts and the offset of every section
+    records     fixed size entries: id, name, address as (offset, length) into the strings section, rating, review_count,
+                latitude and longitude (NaN when the catalog has no coordinates)
+    terms       fixed size entries sorted by term: term as (offset, length), start and count of its postings
+    postings    record numbers, grouped by term
+    strings     UTF-8 text referenced by the records and terms
+"""
+import csv
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+import logging
+
+from geo_index import parse_coordinates
+
+logger = logging.getLogger()
+
+""" --- Constants --- """
+magic = b'RSNP'
+version = 2
+header_format = struct.Struct('<4sHHdIIQQQQ')
+record_format = struct.Struct('<IHIHIHfIff')
+term_format = struct.Struct('<IHII')
+posting_format = struct.Struct('<I')
+term_separator = re.compile(r'[,/&]+')
+
+
+def index_terms(categories):
+    terms = {categories.strip().lower()}
+    for term in term_separator.split(categories):
+        if term.strip():
+            terms.add(term.strip().lower())
+    terms.discard('')
+    return terms
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+class StringTable:
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = {}
+
+    def add(self, text):
+        encoded = text.encode('utf-8')
+        if encoded not in self.offsets:
+            self.offsets[encoded] = len(self.data)
+            self.data.extend(encoded)
+        return self.offsets[encoded], len(encoded)
+
+
+def build_snapshot(csv_path, snapshot_path):
+    """
+    Compiles the restaurants CSV into a snapshot file. Returns the number of records written.
+    """
+    strings = StringTable()
+    records = []
+    postings = {}
+    numbers = {}
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for restaurant in reader:
+            # The catalog lists a restaurant once per cuisine it was scraped for, the first row wins
+            number = numbers.get(restaurant[0])
+            if number is None:
+                number = numbers[restaurant[0]] = len(records)
+                latitude, longitude = parse_coordinates(restaurant[3]) or (math.nan, math.nan)
+                records.append(record_format.pack(
+                    *strings.add(restaurant[0]),
+                    *strings.add(restaurant[1]),
+                    *strings.add(restaurant[2]),
+                    parse_float(restaurant[5]),
+                    parse_int(restaurant[4]),
+                    latitude,
+                    longitude))
+            for term in index_terms(restaurant[7]):
+                postings.setdefault(term, [])
+                if not postings[term] or postings[term][-1] != number:
+                    postings[term].append(number)
+
+    terms = []
+    posting_data = bytearray()
+    posting_count = 0
+    for term in sorted(postings, key=lambda term: term.encode('utf-8')):
+        terms.append(term_format.pack(*strings.add(term), posting_count, len(postings[term])))
+        for number in postings[term]:
+            posting_data.extend(posting_format.pack(number))
+        posting_count += len(postings[term])
+
+    records_offset = header_format.size
+    terms_offset = records_offset + len(records) * record_format.size
+    postings_offset = terms_offset + len(terms) * term_format.size
+    strings_offset = postings_offset + len(posting_data)
+    header = header_format.pack(magic, version, 0, time.time(), len(records), len(terms),
+                                records_offset, terms_offset, postings_offset, strings_offset)
+
+    temporary_path = snapshot_path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(header)
+        for record in records:
+            f.write(record)
+        for term in terms:
+            f.write(term)
+        f.write(posting_data)
+        f.write(strings.data)
+    os.replace(temporary_path, snapshot_path)
+    return len(records)
+
+
+class RestaurantSnapshot:
+    """
+    Read-only view over a memory-mapped snapshot. Pages are loaded by the OS on first access,
+    so lookups only touch the terms, postings and records they need.
+    """
+    # Latitude and longitude are the last two fields of a record, rating and review_count come right before them
+    coordinates_format = struct.Struct('<ff')
+    coordinates_offset = record_format.size - coordinates_format.size
+    stats_format = struct.Struct('<fI')
+    stats_offset = coordinates_offset - stats_format.size
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (file_magic, file_version, _, self.built_at, self.record_count, self.term_count,
+         self.records_offset, self.terms_offset, self.postings_offset, self.strings_offset) = header_format.unpack_from(self.buffer, 0)
+        if file_magic != magic or file_version != version:
+            self.buffer.close()
+            raise ValueError('{} is not a version {} restaurant snapshot'.format(path, version))
+
+    def _string(self, offset, length):
+        start = self.strings_offset + offset
+        return self.buffer[start:start + length].decode('utf-8')
+
+    def _term(self, number):
+        offset, length, start, count = term_format.unpack_from(self.buffer, self.terms_offset + number * term_format.size)
+        position = self.strings_offset + offset
+        return self.buffer[position:position + length], start, count
+
+    def _postings(self, term):
+        key = term.strip().lower().encode('utf-8')
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            candidate, start, count = self._term(middle)
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return start, count
+        return 0, 0
+
+    def record(self, number):
+        id_offset, id_length, name_offset, name_length, address_offset, address_length, rating, review_count, _, _ = \
+            record_format.unpack_from(self.buffer, self.records_offset + number * record_format.size)
+        return {
+            'id': self._string(id_offset, id_length),
+            'name': self._string(name_offset, name_length),
+            'address': self._string(address_offset, address_length),
+            'rating': rating,
+            'review_count': review_count
+        }
+
+    def coordinates(self, number):
+        """
+        Returns (latitude, longitude) of the record, or None when it has no coordinates.
+        """
+        latitude, longitude = self.coordinates_format.unpack_from(self.buffer, self.records_offset + number * record_format.size + self.coordinates_offset)
+        if math.isnan(latitude) or math.isnan(longitude):
+            return None
+        return latitude, longitude
+
+    def stats(self, number):
+        """
+        Returns (rating, review_count) of the record without decoding its strings.
+        """
+        return self.stats_format.unpack_from(self.buffer, self.records_offset + number * record_format.size + self.stats_offset)
+
+    def record_numbers(self, term, limit=None):
+        start, count = self._postings(term)
+        if limit is not None:
+            count = min(count, limit)
+        position = self.postings_offset + start * posting_format.size
+        return [number for (number,) in posting_format.iter_unpack(self.buffer[position:position + count * posting_format.size])]
+
+    def find(self, term, limit=None):
+        """
+        Returns the restaurants indexed under the cuisine or category, in catalog order.
+        """
+        return [self.record(number) for number in self.record_numbers(term, limit)]
+
+    def age_seconds(self):
+        return time.time() - self.built_at
+
+    def close(self):
+        self.buffer.close()
+
+
+def load_snapshot(path, max_age_seconds=None):
+    """
+    Opens the snapshot, or returns None when it is missing, unreadable or older than max_age_seconds.
+    """
+    if not path or not os.path.exists(path):
+        logger.info('No restaurant snapshot at {}'.format(path))
+        return None
+    try:
+        snapshot = RestaurantSnapshot(path)
+    except (OSError, ValueError, struct.error) as e:
+        logger.error('Error while opening restaurant snapshot {}'.format(path))
+        logger.error(e)
+        return None
+    if max_age_seconds is not None and snapshot.age_seconds() > max_age_seconds:
+        logger.info('Restaurant snapshot {} is stale, built {:.0f}s ago'.format(path, snapshot.age_seconds()))
+        snapshot.close()
+        return None
+    return snapshot
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python restaurant_snapshot.py <restaurants.csv> <snapshot path>')
+        sys.exit(1)
+    count = build_snapshot(sys.argv[1], sys.argv[2])
+    print('Wrote {} restaurants to {} ({} bytes)'.format(count, sys.argv[2], os.path.getsize(sys.argv[2])))
@@ -0,0 +1,127 @@
+"""
+Clients shared by lf0, lf1 and lf2.
+Each client is created on first use and then reused for the life of the container, keeping its HTTP connections alive.
+boto3, requests and sendgrid are only imported when the first client that needs them is created,
+so a cold start that never calls out does not pay for loading them.
+"""
+import os
+import threading
+
+""" --- Constants --- """
+max_pool_connections = int(os.environ.get('MAX_POOL_CONNECTIONS', '25'))
+# Socket timeout of the SendGrid requests, so a send lf2 stops waiting for does not keep running
+sendgrid_timeout_seconds = int(os.environ.get('SENDGRID_TIMEOUT_MILLIS', '5000')) / 1000
+# The same for the AWS calls lf2 budgets, instead of botocore's 60s timeouts and up to 10 legacy retries.
+# Other services keep the default read timeout, an SQS long poll waits up to 20s for an answer
+aws_connect_timeout_seconds = int(os.environ.get('AWS_CONNECT_TIMEOUT_MILLIS', '1000')) / 1000
+aws_read_timeout_seconds = {
+    'dynamodb': int(os.environ.get('DYNAMODB_TIMEOUT_MILLIS', '2000')) / 1000,
+    'sns': int(os.environ.get('SNS_TIMEOUT_MILLIS', '3000')) / 1000,
+}
+# Attempts in total, the first one included
+aws_max_attempts = int(os.environ.get('AWS_MAX_ATTEMPTS', '2'))
+
+# Reentrant, a client factory gets the shared boto config through the same cache
+_lock = threading.RLock()
+_clients = {}
+
+
+def _get_or_create(key, factory):
+    client = _clients.get(key)
+    if client is None:
+        # boto3 client creation is not thread safe, and two workers must not race to build the same client
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+    return client
+
+
+def boto_config(service_name=None):
+    def create():
+        from botocore.config import Config
+        timeouts = {'read_timeout': aws_read_timeout_seconds[service_name]} if service_name in aws_read_timeout_seconds else {}
+        return Config(max_pool_connections=max_pool_connections, tcp_keepalive=True, connect_timeout=aws_connect_timeout_seconds,
+                      retries={'mode': 'standard', 'total_max_attempts': aws_max_attempts}, **timeouts)
+
+    return _get_or_create(('config', service_name), create)
+
+
+def client(service_name):
+    def create():
+        import boto3
+        return boto3.client(service_name, config=boto_config(service_name))
+
+    return _get_or_create(('client', service_name), create)
+
+
+def resource(service_name):
+    def create():
+        import boto3
+        return boto3.resource(service_name, config=boto_config(service_name))
+
+    return _get_or_create(('resource', service_name), create)
+
+
+def sendgrid_client(api_key):
+    def create():
+        from sendgrid import SendGridAPIClient
+        client = SendGridAPIClient(api_key)
+        # SendGridAPIClient takes no timeout, the HTTP client it wraps passes this one to every request
+        client.client.timeout = sendgrid_timeout_seconds
+        return client
+
+    return _get_or_create(('sendgrid', api_key), create)
+
+
+class RefreshingAWS4Auth:
+    """
+    SigV4 request signer for the ES domain that reuses its signing key until the credentials change.
+    Refreshable credentials are renewed by botocore when they are about to expire.
+    """
+
+    def __init__(self, credentials, region, service):
+        self.credentials = credentials
+        self.region = region
+        self.service = service
+        self.lock = threading.Lock()
+        self.frozen = None
+        self.auth = None
+
+    def current(self):
+        frozen = self.credentials.get_frozen_credentials()
+        with self.lock:
+            if frozen != self.frozen:
+                from requests_aws4auth import AWS4Auth
+                self.auth = AWS4Auth(frozen.access_key, frozen.secret_key, self.region, self.service, session_token=frozen.token)
+                self.frozen = frozen
+            return self.auth
+
+    def __call__(self, request):
+        return self.current()(request)
+
+
+def es_session(region, service='es'):
+    """
+    requests Session for the ES domain with a pooled keep-alive adapter and SigV4 auth.
+    """
+    def create():
+        import boto3
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_pool_connections)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.auth = RefreshingAWS4Auth(boto3.Session().get_credentials(), region, service)
+        return session
+
+    return _get_or_create(('es', region, service), create)
+
+
+def reset():
+    """
+    Drops every cached client, they are created again on next use.
+    """
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,65 @@
+"""
+Neighborhoods and cities the concierge can suggest restaurants in, with the point suggestions are ranked around.
+lf1 validates the location slot against them and lf2 looks up the point to find the closest restaurants.
+"""
+import re
+
+""" --- Constants --- """
+# (latitude, longitude) of the center of each place
+known_locations = {
+    'manhattan': (40.7831, -73.9712),
+    'brooklyn': (40.6782, -73.9442),
+    'queens': (40.7282, -73.7949),
+    'bronx': (40.8448, -73.8648),
+    'staten island': (40.5795, -74.1502),
+    'midtown': (40.7549, -73.9840),
+    'upper east side': (40.7736, -73.9566),
+    'upper west side': (40.7870, -73.9754),
+    'harlem': (40.8116, -73.9465),
+    'washington heights': (40.8417, -73.9394),
+    'chelsea': (40.7465, -74.0014),
+    'greenwich village': (40.7336, -74.0027),
+    'east village': (40.7265, -73.9815),
+    'lower east side': (40.7150, -73.9843),
+    'soho': (40.7233, -74.0030),
+    'tribeca': (40.7163, -74.0086),
+    'chinatown': (40.7158, -73.9970),
+    'financial district': (40.7075, -74.0113),
+    'williamsburg': (40.7081, -73.9571),
+    'astoria': (40.7644, -73.9235),
+    'long island city': (40.7447, -73.9485),
+    'flushing': (40.7675, -73.8331),
+    'jersey city': (40.7178, -74.0431),
+    'hoboken': (40.7440, -74.0324),
+}
+aliases = {
+    'new york': 'manhattan',
+    'new york city': 'manhattan',
+    'nyc': 'manhattan',
+    'the bronx': 'bronx',
+    'ues': 'upper east side',
+    'uws': 'upper west side',
+    'the village': 'greenwich village',
+    'west village': 'greenwich village',
+    'fidi': 'financial district',
+    'lic': 'long island city',
+}
+non_word = re.compile(r'[^a-z0-9]+')
+state_suffix = re.compile(r' (ny|nj|new york|new jersey)$')
+
+
+def normalise(location):
+    key = non_word.sub(' ', location.lower()).strip()
+    return state_suffix.sub('', key)
+
+
+def find_location(location):
+    """
+    Returns (name, (latitude, longitude)) for a known place, or None.
+    """
+    if not location:
+        return None
+    key = normalise(location)
+    key = aliases.get(key, key)
+    point = known_locations.get(key)
+    return (key, point) if point is not None else None
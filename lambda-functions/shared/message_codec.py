@@ -0,0 +1,77 @@
+"""
+Fulfillment message format between lf1 and lf2.
+
+Version 2 is a JSON array holding the version followed by the normalised slot values in `message_fields` order:
+
+    [2,"Manhattan","indian",4,"2030-01-01","19:30","2125550100","user@example.com","3f2b9c..."]
+
+The fulfillment id at the end is optional. lf1 gives every fulfilled request its own, and lf2 keys its duplicate
+detection on it, so the same request asked for again is still answered.
+Version 1, the raw Lex `slots` dict lf1 used to send, is still decoded so messages enqueued before the rollout are served.
+"""
+import json
+
+""" --- Constants --- """
+version = 2
+message_fields = ['location', 'cuisine', 'numberOfPpl', 'date', 'time', 'phoneNumber', 'emailAddress']
+
+
+class MessageFormatError(ValueError):
+    pass
+
+
+def normalise(values):
+    request = {}
+    for field in message_fields:
+        value = values.get(field)
+        if value is None or str(value).strip() == '':
+            raise MessageFormatError('Missing {}'.format(field))
+        request[field] = str(value).strip()
+    request['cuisine'] = request['cuisine'].lower()
+    try:
+        request['numberOfPpl'] = int(request['numberOfPpl'])
+    except ValueError:
+        raise MessageFormatError('numberOfPpl is not a number-> {}'.format(request['numberOfPpl']))
+    return request
+
+
+def encode(values, fulfillment_id=None):
+    """
+    Encodes the interpreted slot values, and the fulfillment id when given, as a version 2 message body.
+    """
+    request = normalise(values)
+    data = [version] + [request[field] for field in message_fields]
+    if fulfillment_id:
+        data.append(str(fulfillment_id))
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+def decode_legacy(slots):
+    values = {}
+    for field in message_fields:
+        try:
+            values[field] = slots[field]['value']['interpretedValue']
+        except (KeyError, TypeError):
+            raise MessageFormatError('Missing {}'.format(field))
+    return values
+
+
+def decode(body):
+    """
+    Decodes a message body of any supported version into a dict of the normalised fields,
+    plus `fulfillmentId`, None when the message does not carry one.
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise MessageFormatError('Message body is not JSON')
+
+    if isinstance(data, dict):
+        return dict(normalise(decode_legacy(data)), fulfillmentId=None)
+    if not isinstance(data, list) or not data or data[0] != version:
+        raise MessageFormatError('Unsupported message version-> {}'.format(data[0] if isinstance(data, list) and data else None))
+    if len(data) not in (len(message_fields) + 1, len(message_fields) + 2):
+        raise MessageFormatError('Expected {} fields, got {}'.format(len(message_fields), len(data) - 1))
+    request = normalise(dict(zip(message_fields, data[1:])))
+    request['fulfillmentId'] = data[len(message_fields) + 1] if len(data) > len(message_fields) + 1 else None
+    return request
@@ -0,0 +1,123 @@
+"""
+Per-stage timings and counters for the lambdas, emitted once per invocation as a CloudWatch Embedded Metric Format line.
+
+    with metrics.timer('es_query'):
+        ...
+    metrics.increment('cache_hit')
+    metrics.flush()
+"""
+import os
+import json
+import math
+import time
+import random
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+""" --- Constants --- """
+namespace = os.environ.get('METRICS_NAMESPACE', 'DiningConcierge')
+service = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+log_sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+percentiles = [50, 95, 99]
+
+_lock = threading.Lock()
+_timings = {}
+_counters = {}
+
+
+def record(stage, millis):
+    with _lock:
+        _timings.setdefault(stage, []).append(millis)
+
+
+@contextmanager
+def timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, (time.perf_counter() - start) * 1000)
+
+
+def timed(stage):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def rollups():
+    """
+    Returns the rollups recorded since the last flush, without resetting them.
+    """
+    with _lock:
+        timings = {stage: sorted(values) for stage, values in _timings.items()}
+        counters = dict(_counters)
+
+    values = {}
+    units = {}
+    for stage, stage_values in timings.items():
+        for p in percentiles:
+            name = '{}.p{}'.format(stage, p)
+            values[name] = round(percentile(stage_values, p), 3)
+            units[name] = 'Milliseconds'
+        values['{}.count'.format(stage)] = len(stage_values)
+        units['{}.count'.format(stage)] = 'Count'
+    for name, value in counters.items():
+        values[name] = value
+        units[name] = 'Count'
+    return values, units
+
+
+def flush(**dimensions):
+    """
+    Prints the rollups as one EMF line, which CloudWatch Logs turns into metrics, and resets them.
+    """
+    values, units = rollups()
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+    if not values:
+        return None
+
+    dimensions = dict(dimensions, Service=service)
+    document = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [list(dimensions.keys())],
+                'Metrics': [{'Name': name, 'Unit': units[name]} for name in values]
+            }]
+        }
+    }
+    document.update(dimensions)
+    document.update(values)
+    line = json.dumps(document, separators=(',', ':'))
+    print(line)
+    return document
+
+
+def log_sampled(label, payload, rate=None):
+    """
+    Logs a full payload for a sample of the calls only. The payload is only formatted when it is logged.
+    """
+    if random.random() < (log_sample_rate if rate is None else rate):
+        logger.info('%s-> %s', label, payload)